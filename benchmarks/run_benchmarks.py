@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+
+from chipwhisperer_minimal.sca_attacks import cpa_run, dpa_run, tvla_run
+from chipwhisperer_minimal.parallel_attacks import AttackPool
+from chipwhisperer_minimal.simulator import LeakageSimulator
+from chipwhisperer_minimal.generate_c.generate_c_files import generate_c_source
+from sboxes_info import sbox_bic, avg_sac
+
+# Benchmarks of the attacks, TVLA and the s-box metrics on seeded synthetic data, no capture hardware
+# needed. Every case records its best wall time over the repeats, its throughput, and the peak
+# memory allocated while it runs (measured with tracemalloc in a separate run, so it does not slow
+# the timed ones). A case is repeated until it has run for at least --min-time seconds in all, so
+# that the best time of a fast case is not one noisy measurement. Results are written as JSON.
+#
+# Timings only compare on the same machine, so no baseline is kept in the repository. Record one
+# from the tree to compare against, then check a later tree against it:
+#
+#   python benchmarks/run_benchmarks.py --output benchmarks/baseline.json
+#   python benchmarks/run_benchmarks.py --output new.json --baseline benchmarks/baseline.json
+
+SAMPLES = 2500
+TTEST_THRESHOLD = 4.5
+# Differences below these are noise, and never count as regressions whatever their ratio
+NOISE_FLOORS = {"seconds": 0.002, "peak_memory_mb": 1.0}
+
+SCALES = {
+    "quick": {"traces": [50, 1000], "tvla_traces": [1000], "sboxes": [1, 100]},
+    "full": {"traces": [50, 1000, 10000, 100000], "tvla_traces": [1000, 10000, 100000], "sboxes": [1, 100, 10000]},
+}
+
+def random_sboxes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.permutation(256).tolist() for _ in range(count)]
+
+# Leaky traces of the first s-box, as a CWNANO capture of scope.adc.samples = 2500 would give
+def simulated_traces(count, seed=0):
+    sbox = random_sboxes(1, seed)[0]
+    simulator = LeakageSimulator(sbox, samples=SAMPLES, offset=500, spacing=3, seed=seed)
+    textins = np.random.default_rng(seed).integers(0, 256, (count, 16), dtype=np.uint8)
+    return sbox, textins, simulator.traces(textins)
+
+def tvla_groups(count, seed=0):
+    sbox = random_sboxes(1, seed)[0]
+    simulator = LeakageSimulator(sbox, samples=SAMPLES, offset=500, spacing=3, seed=seed)
+    rng = np.random.default_rng(seed)
+    fixed = np.tile(np.arange(16, dtype=np.uint8), (count, 1))
+    return simulator.traces(fixed), simulator.traces(rng.integers(0, 256, (count, 16), dtype=np.uint8))
+
+# One pool for all the sharded cases, shut down with the interpreter
+_pools = []
+
+def _attack_pool():
+    if not _pools:
+        _pools.append(AttackPool())
+    return _pools[0]
+
+def sbox_dict(sboxes):
+    return {f"bench_{i}": {"box": box, "inverse": np.argsort(box).tolist()} for i, box in enumerate(sboxes)}
+
+# Every case is (name, params, setup), setup returning the function to time and the amount of work
+# it does, in `unit`s
+def cases(scale):
+    for n in SCALES[scale]["traces"]:
+        def setup(n=n):
+            sbox, textins, traces = simulated_traces(n)
+            return lambda: cpa_run(sbox, textins, traces), n
+        yield "cpa_run", {"traces": n, "samples": SAMPLES}, "traces", setup
+    for n in SCALES[scale]["traces"]:
+        def setup(n=n):
+            sbox, textins, traces = simulated_traces(n)
+            return lambda: dpa_run(sbox, textins, traces), n
+        yield "dpa_run", {"traces": n, "samples": SAMPLES}, "traces", setup
+    # cpa_run on an AttackPool of every core, started once as num_traces would. Its speed-up is the
+    # ratio to cpa_run of the same size. Its peak memory is only the part in this process.
+    for n in SCALES[scale]["traces"]:
+        def setup(n=n):
+            sbox, textins, traces = simulated_traces(n)
+            pool = _attack_pool()
+            return lambda: pool.cpa_run(sbox, textins, traces), n
+        yield "sharded_cpa_run", {"traces": n, "samples": SAMPLES, "workers": os.cpu_count()}, "traces", setup
+    for n in SCALES[scale]["tvla_traces"]:
+        def setup(n=n):
+            fixed, random = tvla_groups(n)
+            return lambda: tvla_run(fixed, random, TTEST_THRESHOLD), 2 * n
+        yield "tvla_run", {"traces": 2 * n, "samples": SAMPLES}, "traces", setup
+    for name, function in [("sbox_bic", sbox_bic), ("avg_sac", avg_sac)]:
+        for n in SCALES[scale]["sboxes"]:
+            def setup(n=n, function=function):
+                sboxes = random_sboxes(n)
+                return lambda: [function(box) for box in sboxes], n
+            yield name, {"sboxes": n}, "sboxes", setup
+    for n in SCALES[scale]["sboxes"]:
+        def setup(n=n):
+            sboxes = sbox_dict(random_sboxes(n))
+            return lambda: [generate_c_source(name, sboxes) for name in sboxes], n
+        yield "generate_c_source", {"sboxes": n}, "sboxes", setup
+
+def case_key(name, params):
+    return name + "[" + ",".join(f"{key}={value}" for key, value in sorted(params.items())) + "]"
+
+# Best time of at least `repeat` runs, run again until they take min_time seconds in all
+def run_case(function, repeat, min_time=0.5):
+    seconds = []
+    while len(seconds) < repeat or sum(seconds) < min_time:
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(seconds), peak
+
+def run_benchmarks(scale="quick", repeat=3, only=None, min_time=0.5):
+    results = []
+    for name, params, unit, setup in cases(scale):
+        if only and name not in only:
+            continue
+        function, work = setup()
+        seconds, peak = run_case(function, repeat, min_time)
+        result = {
+            "key": case_key(name, params),
+            "name": name,
+            "params": params,
+            "seconds": seconds,
+            "throughput": work / seconds if seconds else None,
+            "unit": f"{unit}/s",
+            "peak_memory_mb": peak / 2**20,
+        }
+        print(f"{result['key']:<45} {seconds:10.4f} s {result['throughput']:14.1f} {result['unit']:<10} {result['peak_memory_mb']:10.1f} MB", flush=True)
+        results.append(result)
+    return {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "scale": scale,
+        "repeat": repeat,
+        "min_time": min_time,
+        "results": results,
+    }
+
+def compare(report, baseline, tolerance=0.25):
+    """Cases slower, or using more memory, than the baseline by more than the tolerance, a fraction,
+    and by more than the NOISE_FLOORS"""
+    base_results = {result["key"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        base = base_results.get(result["key"])
+        if base is None:
+            continue
+        for field in ["seconds", "peak_memory_mb"]:
+            ratio = result[field] / base[field] if base[field] else 1.0
+            if ratio > 1 + tolerance and result[field] - base[field] > NOISE_FLOORS[field]:
+                regressions.append((result["key"], field, base[field], result[field], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the attacks, TVLA and the s-box metrics on synthetic data")
+    parser.add_argument("--scale", choices=list(SCALES), default="quick")
+    parser.add_argument("--repeat", type=int, default=3, help="least number of timed runs of a case")
+    parser.add_argument("--min-time", type=float, default=0.5, help="least total seconds of the timed runs of a case")
+    parser.add_argument("--only", nargs="*", help="names of the benchmarks to run, e.g. cpa_run avg_sac")
+    parser.add_argument("--output", default=f"{current_dir}/results.json")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline, as a fraction")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scale, args.repeat, args.only, args.min_time)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for key, field, before, after, ratio in regressions:
+            print(f"REGRESSION {key} {field}: {before:.4f} -> {after:.4f} ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.baseline} (tolerance {args.tolerance:.0%})")
@@ -0,0 +1,159 @@
+import multiprocessing as mp
+import queue
+from collections import deque
+import traceback
+from chipwhisperer_minimal.metrics import num_traces, tvla, cpa_metrics, dpa_metrics, template_metrics, tvla_metrics
+from chipwhisperer_minimal.result_store import ResultStore, DEFAULT_PATH, unit_key
+
+# Campaign scheduler. A campaign is a list of units of work, (sbox_name, attack_method, aes_mode, platform),
+# run concurrently on several capture targets. Every target gets its own worker process with its own
+# capture backend, and takes the next unit of its platform from a shared queue as soon as it is free.
+
+METHODS = ["CPA", "DPA", "TEMPLATE", "TVLA"]
+
+# Every combination of the given sboxes, attack methods, AES modes and platforms
+def campaign_units(sbox_names, attack_methods, aes_modes, platforms):
+    return [(sbox_name, method.upper(), aes_mode, platform)
+            for platform in platforms
+            for method in attack_methods
+            for aes_mode in aes_modes
+            for sbox_name in sbox_names]
+
+# Runs one unit on a prepared-on-demand backend and returns its metric. With a store, the unit's runs
+# and result are saved to it, and resumed from it.
+def run_unit(unit, backend, sboxes, store=None):
+    sbox_name, attack_method, aes_mode, platform = unit
+    if attack_method == "TVLA":
+        return tvla(sbox_name, platform, tvla_metrics, aes_mode, backend=backend, store=store)
+    elif attack_method in ["CPA", "DPA", "TEMPLATE"]:
+        metrics = {"CPA": cpa_metrics, "DPA": dpa_metrics, "TEMPLATE": template_metrics}[attack_method]
+        sbox = sboxes[sbox_name]
+        if isinstance(sbox, dict):
+            sbox = sbox["box"]
+        return num_traces(sbox_name, sbox, platform, metrics, backend=backend, aes_mode=aes_mode, store=store)
+    raise ValueError(f"Invalid attack method {attack_method}, expected one of {METHODS}")
+
+def _worker(target_index, backend_factory, sboxes, store_path, tasks, results):
+    try:
+        backend = backend_factory()
+        store = ResultStore(store_path) if store_path else None
+    except Exception:
+        results.put(("dead", target_index, None, traceback.format_exc()))
+        return
+    results.put(("ready", target_index, None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        try:
+            value = run_unit(task[0], backend, sboxes, store)
+            results.put(("done", target_index, task, value))
+        except Exception:
+            try:
+                backend.close()
+            except Exception:
+                pass
+            results.put(("failed", target_index, task, traceback.format_exc()))
+
+
+def run_campaign(units, targets, sboxes, max_retries=2, on_result=None, store_path=DEFAULT_PATH):
+    """Runs the units on the targets and returns {unit: metric}.
+
+    targets is a list of (platform, backend_factory) pairs, one per attached capture target. The
+    factory is called in the target's worker process and must be picklable, e.g.
+    functools.partial(ChipWhispererBackend, serial_number=...), or a SimulatorBackend partial to try a
+    campaign without hardware. A unit that raises, or whose target dies, is run again, up to
+    max_retries times.
+
+    Every run and result is saved to the ResultStore at store_path as soon as it is done. Units already
+    finished in the store are skipped, and a unit that was interrupted continues from its last run.
+    Results are also handed to on_result(unit, value) as they arrive. Units that fail every attempt
+    are reported and left out of the returned dict."""
+    if store_path:
+        store = ResultStore(store_path)
+        completed = store.completed_units()
+        store.close()
+        skipped = [unit for unit in units if unit_key(unit[0], unit[3], unit[1], unit[2]) in completed]
+        if skipped:
+            print(f"Skipping {len(skipped)} units already in {store_path}")
+        units = [unit for unit in units if unit not in skipped]
+
+    platforms = {platform for platform, _ in targets}
+    waiting = {platform: deque() for platform in platforms}
+    for unit in units:
+        if unit[3] not in platforms:
+            print(f"No target for {unit[3]}, skipping {unit}")
+            continue
+        waiting[unit[3]].append((unit, 0))
+
+    # Every worker has its own task queue, so the unit a target is running is always known here
+    results = mp.Queue()
+    workers = []
+    for index, (platform, factory) in enumerate(targets):
+        tasks = mp.Queue()
+        worker = mp.Process(target=_worker, args=(index, factory, sboxes, store_path, tasks, results), daemon=True)
+        worker.start()
+        workers.append((worker, tasks))
+    alive = set(range(len(targets)))
+    idle = set()
+    running = {}
+
+    def retry(task):
+        unit, attempt = task
+        if attempt < max_retries:
+            waiting[unit[3]].append((unit, attempt + 1))
+        else:
+            print(f"Giving up on {unit} after {attempt + 1} attempts")
+
+    def lose(index):
+        alive.discard(index)
+        idle.discard(index)
+        if index in running:
+            retry(running.pop(index))
+
+    finished = {}
+    while running or any(waiting[targets[index][0]] for index in alive):
+        for index in sorted(idle):
+            queued = waiting[targets[index][0]]
+            if queued:
+                running[index] = queued.popleft()
+                workers[index][1].put(running[index])
+                idle.discard(index)
+
+        try:
+            status, index, task, payload = results.get(timeout=1)
+        except queue.Empty:
+            # A worker that died without reporting, e.g. on a USB driver crash
+            for index in sorted(alive):
+                worker = workers[index][0]
+                if not worker.is_alive():
+                    print(f"Target {index} ({targets[index][0]}) exited with code {worker.exitcode}")
+                    lose(index)
+            continue
+
+        if status == "ready":
+            idle.add(index)
+        elif status == "dead":
+            print(f"Target {index} ({targets[index][0]}) could not be set up:\n{payload}")
+            lose(index)
+        elif status == "done":
+            del running[index]
+            idle.add(index)
+            finished[task[0]] = payload
+            if on_result is not None:
+                on_result(task[0], payload)
+        else:
+            del running[index]
+            idle.add(index)
+            print(f"{task[0]} failed on target {index} (attempt {task[1] + 1}):\n{payload}")
+            retry(task)
+
+    for platform, queued in waiting.items():
+        for unit, _ in queued:
+            print(f"No working target for {platform}, {unit} was not run")
+    for worker, tasks in workers:
+        tasks.put(None)
+    for worker, _ in workers:
+        worker.join(timeout=5)
+    return finished
@@ -0,0 +1,137 @@
+import glob
+import os
+import numpy as np
+from chipwhisperer_minimal.helper_functions import *
+
+# Capture backends are the sources of traces used by num_traces and tvla. A backend is prepared once
+# per S-box, then asked for batches of traces until it is closed.
+
+class CaptureBackend:
+    """Interface of a trace source"""
+
+    # Key the traces are captured with
+    key = KNOWN_KEY
+    # Identifies the firmware image the traces come from, if the backend knows it
+    firmware_id = None
+
+    # Gets the source ready to capture traces of the given sbox, platform and AES mode
+    def prepare(self, sbox_name, platform="CWNANO", aes_mode=None):
+        raise NotImplementedError
+
+    # Returns N textins and N traces, as arrays
+    def capture(self, N):
+        raise NotImplementedError
+
+    # Returns the fixed and the random group of a TVLA capture of about N traces each
+    def capture_tvla(self, N):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ChipWhispererBackend(CaptureBackend):
+    """Builds the firmware for the sbox, programs a ChipWhisperer with it and captures from it.
+    serial_number selects the ChipWhisperer when several are attached."""
+
+    def __init__(self, c_target="TINYAES128C", serial_number=None):
+        self.c_target = c_target
+        self.serial_number = serial_number
+        self.setup_result = None
+
+    def prepare(self, sbox_name, platform="CWNANO", aes_mode=None):
+        tags = dict(sbox=sbox_name, device=platform, aes_mode=aes_mode)
+        with span("make_firmware", **tags):
+            hex_file = make_firmware(sbox_name, platform, c_target = self.c_target, scope_t = 'OPENADC', sbox2 = False, aes_mode=aes_mode)
+        self.firmware_id = os.path.splitext(os.path.basename(hex_file))[0]
+        with span("connect", **tags):
+            self.setup_result = setup_scope_prog(platform, sn=self.serial_number)
+
+        print("Programming target")
+        import chipwhisperer as cw
+        with span("program_target", **tags):
+            cw.program_target(self.setup_result[0], self.setup_result[1], hex_file)
+
+    def capture(self, N):
+        return gather_trace_pool(self.setup_result, N=N)
+
+    def capture_tvla(self, N):
+        return tvla_gather_n_traces(self.setup_result, N=N)
+
+    def close(self):
+        # Disconnects the CW device
+        if self.setup_result is not None:
+            self.setup_result[0].dis()
+            self.setup_result = None
+
+
+class ReplayBackend(CaptureBackend):
+    """Streams recorded (textin, key, trace) batches back from .npz files on disk.
+
+    The batches of an sbox are read from `directory/<sbox_name>/` if it exists, else from `directory`
+    itself, in file name order. With loop, the files are read again once they are exhausted. The key
+    is the one recorded with the first batch."""
+
+    def __init__(self, directory, loop=True):
+        self.directory = directory
+        self.loop = loop
+        self.files = []
+
+    def prepare(self, sbox_name, platform="CWNANO", aes_mode=None):
+        sbox_dir = os.path.join(self.directory, sbox_name)
+        root = sbox_dir if os.path.isdir(sbox_dir) else self.directory
+        self.files = sorted(glob.glob(os.path.join(root, "*.npz")))
+        if not self.files:
+            raise FileNotFoundError(f"No recorded batches for {sbox_name} in {root}")
+        # Known before the first capture, as num_traces checks the attacks against it
+        with np.load(self.files[0]) as batch:
+            self.key = batch["key"][0].tolist()
+        self._batches = self._read_batches()
+        self._buffer = None
+
+    def _read_batches(self):
+        while True:
+            for filename in self.files:
+                with np.load(filename) as batch:
+                    yield batch["textin"], batch["key"], batch["trace"]
+            if not self.loop:
+                return
+
+    # Reads the next N rows of the stream, carrying over what is left of the last batch
+    def _read(self, N):
+        parts = [] if self._buffer is None else [self._buffer]
+        available = 0 if self._buffer is None else len(self._buffer[0])
+        while available < N:
+            batch = next(self._batches, None)
+            if batch is None:
+                break
+            parts.append(batch)
+            available += len(batch[0])
+        if not parts:
+            raise EOFError("Recorded batches exhausted")
+
+        textins, keys, traces = [np.concatenate(column) for column in zip(*parts)]
+        self._buffer = (textins[N:], keys[N:], traces[N:]) if available > N else None
+        return textins[:N], keys[:N], traces[:N]
+
+    def capture(self, N):
+        textins, _, traces = self._read(N)
+        return textins, traces
+
+    # The fixed group is recognised by its textin, as in tvla_gather_n_traces
+    def capture_tvla(self, N):
+        textins, _, traces = self._read(2 * N)
+        fixed = np.all(textins == np.asarray(TVLA_FIXED_TEXT, dtype=np.uint8), axis=1)
+        return traces[fixed], traces[~fixed]
+
+
+# Appends a batch to a replay directory, as the next file in name order
+def save_batch(directory, textins, keys, traces):
+    os.makedirs(directory, exist_ok=True)
+    index = len(glob.glob(os.path.join(directory, "*.npz")))
+    np.savez(
+        os.path.join(directory, f"batch_{index:06d}.npz"),
+        textin=np.asarray(textins, dtype=np.uint8),
+        key=np.asarray(keys, dtype=np.uint8),
+        trace=np.asarray(traces),
+    )
@@ -0,0 +1,75 @@
+import numpy as np
+from chipwhisperer_minimal.online_attacks import CPAAccumulator, DPAAccumulator
+
+# Success rate and guessing entropy curves. Every permutation of a trace pool is fed once, in
+# order, to an online accumulator, and the rank of every key byte is read off at each count of a grid
+# on the way. So one pass gives the whole curve for about the cost of a single attack on all the
+# traces, where num_traces repeats full attacks at every midpoint of its search.
+
+ACCUMULATORS = {
+    "CPA": CPAAccumulator,
+    "DPA": DPAAccumulator,
+}
+
+# Default grid of trace counts, about `points` counts spaced logarithmically up to the pool size
+def count_grid(pool_size, points=25, start=5):
+    return np.unique(np.geomspace(start, pool_size, points).astype(int))
+
+def key_rank_curves(sbox, textin_array, trace_array, known_key, counts, permutations=100, method="CPA", seed=None):
+    """(permutations, counts, 16) rank of every key byte after each count of traces, 0 meaning the byte
+    is recovered, for random permutations of the pool"""
+    textins = np.asarray(textin_array, dtype=np.uint8)
+    traces = np.asarray(trace_array)
+    counts = sorted(int(count) for count in counts)
+    if counts[-1] > len(traces):
+        raise ValueError(f"Largest count {counts[-1]} is above the pool size {len(traces)}")
+
+    rng = np.random.default_rng(seed)
+    ranks = np.zeros((permutations, len(counts), 16), dtype=np.int64)
+    for p in range(permutations):
+        order = rng.permutation(len(traces))[:counts[-1]]
+        accumulator = ACCUMULATORS[method.upper()](sbox)
+        start = 0
+        for c, count in enumerate(counts):
+            accumulator.add_traces(textins[order[start:count]], traces[order[start:count]])
+            start = count
+            ranks[p, c] = accumulator.key_ranks(known_key)
+    return ranks
+
+# Wilson score interval of a binomial proportion, which stays in [0, 1] near a rate of 0 or 1
+def wilson_interval(successes, n, z=1.96):
+    successes = np.asarray(successes, dtype=np.float64)
+    rate = successes / n
+    center = (rate + z**2 / (2 * n)) / (1 + z**2 / n)
+    half_width = z * np.sqrt(rate * (1 - rate) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+    return center - half_width, center + half_width
+
+def curve_table(counts, ranks, order=1, z=1.96):
+    """One row per count with the success rate of the full key (every byte ranked below `order`), the
+    mean success rate and guessing entropy of the bytes, and their confidence intervals. The guessing
+    entropy is the mean rank of a key byte, starting at 0, with a normal interval over the
+    permutations."""
+    permutations = ranks.shape[0]
+    full_key = np.all(ranks < order, axis=2).sum(axis=0)
+    sr_low, sr_high = wilson_interval(full_key, permutations, z)
+
+    byte_success = (ranks < order).mean(axis=2)
+    entropy = ranks.mean(axis=2)
+    half_width = z * entropy.std(axis=0, ddof=1) / np.sqrt(permutations) if permutations > 1 else np.nan
+    import pandas as pd
+    return pd.DataFrame({
+        "n_traces": counts,
+        "success_rate": full_key / permutations,
+        "success_rate_low": sr_low,
+        "success_rate_high": sr_high,
+        "byte_success_rate": byte_success.mean(axis=0),
+        "guessing_entropy": entropy.mean(axis=0),
+        "guessing_entropy_low": entropy.mean(axis=0) - half_width,
+        "guessing_entropy_high": entropy.mean(axis=0) + half_width,
+    })
+
+# Smallest count of the table with a success rate of at least `rate`, -1 if there is none, as in
+# num_traces
+def traces_for_success(table, rate=0.9):
+    reached = table[table["success_rate"] >= rate]
+    return int(reached["n_traces"].iloc[0]) if len(reached) else -1
@@ -1,8 +1,10 @@
-import numpy as np
-import pickle
-import pandas as pd
 import math
 import os
+import sys
+
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(root_dir)
+from chipwhisperer_minimal.sbox_catalog import load_catalog
 
 # Takes an s-box and converts it to an array in c-code, expressed as a string
 def c_array(sbox, inv=False):
@@ -42,32 +44,45 @@ def generate_c_file(sbox_info, prelude, postlude, complement, current_dir):
     return "\n".join(aes_list)
 
 
-# Generate c-files. If no parameter given, generate all of them. Otherwise, generate just one.
-def generate_c_files(name=None):
-    current_dir = os.path.dirname(os.path.realpath(__file__))
-
-
+def read_parts(current_dir):
     with open(f"{current_dir}/aes_prelude.c.part", "r") as f:
         prelude = "".join(f.readlines())
     with open(f"{current_dir}/aes_postlude.c.part", "r") as f:
         postlude = "".join(f.readlines())
     with open(f"{current_dir}/aes_complement.c.part", "r") as f:
         complement = "".join(f.readlines())
+    return prelude, postlude, complement
 
-    with open(f"{current_dir}/sboxes_info.pkl", "rb") as f:
-        sbox_df = pickle.load(f)
+# The s-box catalog written by sboxes_info.py, memory mapped once and then reused
+def load_sbox_dict(current_dir):
+    return load_catalog(f"{current_dir}/sbox_catalog")
 
-    sbox_dict = sbox_df.T.to_dict()
+# Returns the aes.c source of a single s-box, or None if there is no such s-box
+def generate_c_source(name, sbox_dict=None):
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    if sbox_dict is None:
+        sbox_dict = load_sbox_dict(current_dir)
 
-    if name:
-        # Check if name exists:
-        if name in sbox_dict.keys():
-            with open(f"{current_dir}/../firmware/crypto/tiny-AES128-C/aes.c", "w") as f:
-                f.write(generate_c_file(sbox_dict[name], prelude, postlude, complement, current_dir))
+    # Check if name exists:
+    if name not in sbox_dict:
+        print("No such key exists:", name)
+        return None
+    prelude, postlude, complement = read_parts(current_dir)
+    return generate_c_file(sbox_dict[name], prelude, postlude, complement, current_dir)
 
-        else:
-            print("No such key exists:", name)
+# Generate c-files. If no parameter given, generate all of them. Otherwise, generate just one.
+def generate_c_files(name=None):
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+
+    prelude, postlude, complement = read_parts(current_dir)
+    sbox_dict = load_sbox_dict(current_dir)
+
+    if name:
+        source = generate_c_source(name, sbox_dict)
+        if source is None:
             return
+        with open(f"{current_dir}/../firmware/crypto/tiny-AES128-C/aes.c", "w") as f:
+            f.write(source)
 
     else:
         for name in sbox_dict.keys():
@@ -1,24 +1,35 @@
-import chipwhisperer as cw
+import hashlib
 import os
 from math import *
-import pickle
+import shutil
 import subprocess
 import sys
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
-from tqdm import trange
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(current_dir)
-from generate_c.generate_c_files import generate_c_files
+from generate_c.generate_c_files import generate_c_files, generate_c_source, load_sbox_dict
+from chipwhisperer_minimal.instrumentation import span, count
 
-# Sets up a cw device
-def setup_scope_prog(PLATFORM="CWNANO"):
+# chipwhisperer and tqdm are imported by the functions that talk to the device, so that analysis and
+# replay runs, which only need the helpers below, never load the hardware stack.
+
+# Key of cw.ktp.Basic(), which gather_n_traces keeps fixed
+KNOWN_KEY = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
+# Plaintext of the fixed group of cw.ktp.TVLATTest()
+TVLA_FIXED_TEXT = bytearray([0xDA,0x39,0xA3,0xEE,0x5E,0x6B,0x4B,0x0D,0x32,0x55,0xBF,0xEF,0x95,0x60,0x18,0x90])
+
+# Sets up a cw device. With several devices attached, sn picks one by its serial number.
+def setup_scope_prog(PLATFORM="CWNANO", sn=None):
+    import chipwhisperer as cw
     try:
         if not scope.connectStatus:
             scope.con()
     except NameError:
-        scope = cw.scope()
+        scope = cw.scope(sn=sn)
 
     target_type = cw.targets.SimpleSerial
 
@@ -31,7 +42,7 @@ def setup_scope_prog(PLATFORM="CWNANO"):
         print(
             "INFO: This is a work-around when USB has died without Python knowing. Ignore errors above this line."
         )
-        scope = cw.scope()
+        scope = cw.scope(sn=sn)
         target = cw.target(scope, target_type)
 
     print("INFO: Found ChipWhisperer😍")
@@ -42,13 +53,16 @@ def setup_scope_prog(PLATFORM="CWNANO"):
     else:
         prog = None
     
-    time.sleep(0.05)
+    with span("sleep"):
+        time.sleep(0.05)
     scope.default_setup()
     scope.adc.samples = 2500
     
     return (scope, prog, target)
 
 def gather_n_traces(setup_result, N=100):
+    import chipwhisperer as cw
+    from tqdm import trange
     scope, prog, target = setup_result
 
     ktp = cw.ktp.Basic()
@@ -66,6 +80,7 @@ def gather_n_traces(setup_result, N=100):
         ret = scope.capture()
         if ret:
             print("Target timed out!")
+            count("target_timeout")
             continue
 
         response = target.simpleserial_read('r', 16)
@@ -77,7 +92,21 @@ def gather_n_traces(setup_result, N=100):
 
     return textin_array, trace_array
 
+# Captures one pool of (textin, trace) pairs up front, so that repeated experiments can resample it
+# with draw_from_pool instead of re-capturing
+def gather_trace_pool(setup_result, N=1000):
+    textin_array, trace_array = gather_n_traces(setup_result, N=N)
+    return np.asarray(textin_array, dtype=np.uint8), np.asarray(trace_array)
+
+# Draws N distinct traces from a pool, at random without replacement
+def draw_from_pool(pool, N, rng):
+    textins, traces = pool
+    chosen = rng.choice(len(traces), size=min(N, len(traces)), replace=False)
+    return textins[chosen], traces[chosen]
+
 def tvla_gather_n_traces(setup_result, N=100):
+    import chipwhisperer as cw
+    from tqdm import trange
     scope, prog, target = setup_result
 
     ktp = cw.ktp.TVLATTest()
@@ -85,7 +114,7 @@ def tvla_gather_n_traces(setup_result, N=100):
     group1 = []
     group2 = []
 
-    fixed_text = bytearray([0xDA,0x39,0xA3,0xEE,0x5E,0x6B,0x4B,0x0D,0x32,0x55,0xBF,0xEF,0x95,0x60,0x18,0x90])
+    fixed_text = TVLA_FIXED_TEXT
     key, text = ktp.next()
 
     for _ in trange(2 * N, desc=f"Gathering {N*2} traces", leave=False):
@@ -93,6 +122,7 @@ def tvla_gather_n_traces(setup_result, N=100):
         trace = cw.capture_trace(scope, target, text, key)
         if trace is None:
             print("No trace found!")
+            count("missing_trace")
             continue 
         if trace.textin == fixed_text:
             group1.append(trace.wave)
@@ -103,9 +133,11 @@ def tvla_gather_n_traces(setup_result, N=100):
 
 def reset_target(scope):
     scope.io.nrst = 'low'
-    time.sleep(0.05)
+    with span("sleep"):
+        time.sleep(0.05)
     scope.io.nrst = 'high_z'
-    time.sleep(0.05)
+    with span("sleep"):
+        time.sleep(0.05)
 
 
 
@@ -133,15 +165,73 @@ def generate_n_complement(sbox, n):
     
     return comp_sbox
 
-# def program_device()
-
-def make_firmware(name_sbox, platform = 'CWNANO', c_target = 'TINYAES128C', scope_t = 'OPENADC', sbox2 = False, aes_mode=None):
-    
-    pickle_file = f"{current_dir}/generate_c/sboxes_info.pkl"
-    with open(pickle_file, "rb") as f:
-        sbox_info = pickle.load(f).T.to_dict()
-    # Generate c file
-    generate_c_files(name_sbox)
-    subprocess.run(["make", f"PLATFORM={platform}", f"CRYPTO_TARGET={c_target}", f"SBOX2=0", f"AES_MODE={aes_mode}"],  cwd=f"{current_dir}/firmware/simpleserial-aes")
-    return
-
+# Built firmware images are cached in BUILD_CACHE_DIR, named by a hash of the generated aes.c, the
+# firmware tree it is built in and the build parameters
+BUILD_CACHE_DIR = f"{current_dir}/firmware/build_cache"
+# Build outputs, left out of the copy of the firmware tree and of its digest
+FIRMWARE_IGNORE = shutil.ignore_patterns("build_cache", "objdir*", "ide_projects", "*.hex", "*.elf")
+# Replaced by the generated source in every build
+GENERATED_SOURCE = os.path.join("crypto", "tiny-AES128-C", "aes.c")
+
+# Digest of every file build_firmware copies, so that editing simpleserial-aes.c, the crypto sources,
+# the Makefiles or the HAL invalidates the cached images
+def firmware_tree_digest(firmware_dir=f"{current_dir}/firmware"):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(firmware_dir):
+        ignored = FIRMWARE_IGNORE(root, dirs + files)
+        dirs[:] = sorted(d for d in dirs if d not in ignored)
+        for name in sorted(f for f in files if f not in ignored):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, firmware_dir)
+            if relative == GENERATED_SOURCE:
+                continue
+            digest.update(relative.encode() + b"\0")
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def firmware_hash(source, platform, c_target, aes_mode, tree_digest=None):
+    if tree_digest is None:
+        tree_digest = firmware_tree_digest()
+    return hashlib.sha256(f"{platform}|{c_target}|{aes_mode}|{tree_digest}|{source}".encode()).hexdigest()
+
+# Builds the firmware for the given aes.c source in a private copy of the firmware tree, so that
+# builds never clobber the shared aes.c or each other's object files. Returns the cached image.
+def build_firmware(source, platform, c_target, aes_mode, cached_hex):
+    with tempfile.TemporaryDirectory(prefix="simpleserial-aes-") as build_dir:
+        firmware_dir = os.path.join(build_dir, "firmware")
+        shutil.copytree(f"{current_dir}/firmware", firmware_dir, ignore=FIRMWARE_IGNORE)
+        with open(os.path.join(firmware_dir, GENERATED_SOURCE), "w") as f:
+            f.write(source)
+        subprocess.run(["make", f"PLATFORM={platform}", f"CRYPTO_TARGET={c_target}", f"SBOX2=0", f"AES_MODE={aes_mode}"],
+                       cwd=f"{firmware_dir}/simpleserial-aes", check=True)
+
+        os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+        shutil.copyfile(f"{firmware_dir}/simpleserial-aes/simpleserial-aes-{platform}.hex", f"{cached_hex}.tmp")
+        os.replace(f"{cached_hex}.tmp", cached_hex)
+    return cached_hex
+
+# Returns the path of the firmware image for the sbox, building it only if it is not cached yet.
+# Raises KeyError if the sbox is not in the catalog.
+def make_firmware(name_sbox, platform = 'CWNANO', c_target = 'TINYAES128C', scope_t = 'OPENADC', sbox2 = False, aes_mode=None, sbox_dict=None, tree_digest=None):
+    source = generate_c_source(name_sbox, sbox_dict)
+    if source is None:
+        raise KeyError(f"No s-box named {name_sbox} in the catalog")
+
+    cached_hex = f"{BUILD_CACHE_DIR}/{firmware_hash(source, platform, c_target, aes_mode, tree_digest)}.hex"
+    if os.path.exists(cached_hex):
+        return cached_hex
+    build_firmware(source, platform, c_target, aes_mode, cached_hex)
+    return cached_hex
+
+# Builds the firmware images of every sbox x platform x AES mode in parallel, skipping cached ones
+def prebuild_firmware(sbox_names, platforms=("CWNANO",), aes_modes=("ECB",), c_target='TINYAES128C', workers=None):
+    sbox_dict = load_sbox_dict(f"{current_dir}/generate_c")
+    tree_digest = firmware_tree_digest()
+    jobs = [(name, platform, aes_mode) for name in sbox_names for platform in platforms for aes_mode in aes_modes]
+    # The work is done by make, so threads are enough to run the builds in parallel
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(make_firmware, name, platform, c_target, aes_mode=aes_mode, sbox_dict=sbox_dict, tree_digest=tree_digest): (name, platform, aes_mode)
+                   for name, platform, aes_mode in jobs}
+        hex_files = {futures[future]: future.result() for future in as_completed(futures)}
+    return hex_files
@@ -0,0 +1,166 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+import numpy as np
+
+# Instrumentation of the stages of a campaign: building and programming the firmware, capturing,
+# attacking and waiting. A span times one call of a stage and a counter adds up a quantity, both
+# tagged with whatever identifies the work (sbox, device, method, aes_mode, midpoint, ...). Events
+# are written as JSON lines through the "ChipWhisperer Instrumentation" logger of logging.py, and
+# summed up in memory for summary() and report().
+#
+# Instrumentation is off until enable() is called. While it is off, span() returns a shared no-op
+# context manager and count() returns at once, so the instrumented code runs at full speed.
+
+_recorder = None
+_NULL_SPAN = nullcontext()
+
+def span(stage, traces=None, **tags):
+    """Context manager timing one call of a stage. traces is the number of traces the call handles,
+    for the traces/second of the stage."""
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(_recorder, stage, traces, tags)
+
+def count(name, value=1, **tags):
+    if _recorder is not None:
+        _recorder.count(name, value, tags)
+
+def enabled():
+    return _recorder is not None
+
+def enable(path=None):
+    """Starts recording. Events go to the JSON lines file at path, by default instrumentation.jsonl
+    in the ChipWhisperer log directory. Returns the Recorder."""
+    global _recorder
+    from chipwhisperer_minimal.logging import instrumentation_logger, add_instrumentation_file
+    handler = add_instrumentation_file(path)
+    _recorder = Recorder(instrumentation_logger, handler)
+    return _recorder
+
+def disable():
+    """Stops recording and returns the Recorder, whose summary is still available"""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.logger.removeHandler(recorder.handler)
+        recorder.handler.close()
+    return recorder
+
+
+class _Span:
+    __slots__ = ("recorder", "stage", "traces", "tags", "start", "wall_start")
+
+    def __init__(self, recorder, stage, traces, tags):
+        self.recorder = recorder
+        self.stage = stage
+        self.traces = traces
+        self.tags = tags
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        error = exc_type.__name__ if exc_type is not None else None
+        self.recorder.span(self.stage, self.wall_start, seconds, self.traces, self.tags, error)
+        return False
+
+
+class Recorder:
+    """Writes the events and keeps the per-stage totals"""
+
+    def __init__(self, logger, handler=None):
+        self.logger = logger
+        self.handler = handler
+        # Where the events go and when recording started, for summarize_file(recorder.path, since=recorder.started)
+        self.path = getattr(handler, "baseFilename", None)
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.traces = {}
+        self.errors = {}
+        self.counters = {}
+
+    def span(self, stage, start, seconds, traces, tags, error=None):
+        event = {"event": "span", "stage": stage, "start": start, "seconds": seconds}
+        if traces is not None:
+            event["traces"] = int(traces)
+        if error is not None:
+            event["error"] = error
+        event.update(tags)
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+            self.traces[stage] = self.traces.get(stage, 0) + (int(traces) if traces is not None else 0)
+            if error is not None:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+        self.logger.info(json.dumps(event, default=str))
+
+    def count(self, name, value, tags):
+        event = {"event": "count", "name": name, "value": value, "time": time.time()}
+        event.update(tags)
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self.logger.info(json.dumps(event, default=str))
+
+    def summary(self):
+        """Per stage: calls, errors, total and mean seconds, latency percentiles, and traces/second
+        over the time spent in the stage. Then the counter totals."""
+        with self.lock:
+            return summarize(self.durations, self.traces, self.errors, self.counters)
+
+    def report(self):
+        return format_summary(self.summary())
+
+
+def summarize(durations, traces, errors, counters):
+    stages = {}
+    for stage, seconds in durations.items():
+        seconds = np.asarray(seconds)
+        total = float(seconds.sum())
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+        stages[stage] = {
+            "calls": len(seconds),
+            "errors": errors.get(stage, 0),
+            "total_seconds": total,
+            "mean_seconds": total / len(seconds),
+            "p50_seconds": float(p50),
+            "p90_seconds": float(p90),
+            "p99_seconds": float(p99),
+            "traces": traces.get(stage, 0),
+            "traces_per_s": traces.get(stage, 0) / total if total else 0.0,
+        }
+    return {"stages": stages, "counters": dict(counters)}
+
+def summarize_file(path, since=None):
+    """Summary of the events of a JSON lines file, e.g. of a campaign that is still running, or of
+    one whose workers wrote their events from other processes. With since, a time.time() value,
+    only the events from then on are counted, the file being appended to by every run."""
+    durations, traces, errors, counters = {}, {}, {}, {}
+    with open(path, "r") as f:
+        for line in f:
+            event = json.loads(line)
+            if since is not None and event.get("start", event.get("time", 0)) < since:
+                continue
+            if event["event"] == "span":
+                stage = event["stage"]
+                durations.setdefault(stage, []).append(event["seconds"])
+                traces[stage] = traces.get(stage, 0) + event.get("traces", 0)
+                if "error" in event:
+                    errors[stage] = errors.get(stage, 0) + 1
+            elif event["event"] == "count":
+                counters[event["name"]] = counters.get(event["name"], 0) + event["value"]
+    return summarize(durations, traces, errors, counters)
+
+def format_summary(summary):
+    stages = summary["stages"]
+    lines = [f"{'stage':<16}{'calls':>8}{'errors':>8}{'total s':>12}{'p50 s':>10}{'p90 s':>10}{'p99 s':>10}{'traces/s':>12}"]
+    for name, stage in sorted(stages.items(), key=lambda item: -item[1]["total_seconds"]):
+        lines.append(f"{name:<16}{stage['calls']:>8}{stage['errors']:>8}{stage['total_seconds']:>12.2f}"
+                     f"{stage['p50_seconds']:>10.4f}{stage['p90_seconds']:>10.4f}{stage['p99_seconds']:>10.4f}{stage['traces_per_s']:>12.1f}")
+    for name, value in sorted(summary["counters"].items()):
+        lines.append(f"{name}: {value}")
+    return "\n".join(lines)
@@ -0,0 +1,74 @@
+from functools import lru_cache
+import numpy as np
+
+# Leakage models of the first round S-box output. For a given s-box a model only has 256 x 256
+# values, one per (textin byte, key guess), so each one is computed once into a uint8 table and
+# cached. The attacks get the hypotheses of a whole batch of traces for every key guess with a single
+# fancy index, table[textins[:, byteindex]].
+#
+# A model is a function of the intermediate sbox[p ^ k] (or sbox[sboxcomp[p ^ k]] with a complement,
+# as in aes_internal) and of the s-box input p ^ k, registered under a name with register_model.
+
+HW_TABLE = np.array([bin(n).count("1") for n in range(256)], dtype=np.uint8)
+
+LEAKAGE_MODELS = {}
+
+@lru_cache(maxsize=256)
+def _cached_table(sbox, model, sboxcomp):
+    guesses = np.arange(256, dtype=np.uint8)
+    sbox_input = np.arange(256, dtype=np.uint8)[:, None] ^ guesses[None, :]
+    index = sbox_input if sboxcomp is None else np.asarray(sboxcomp, dtype=np.uint8)[sbox_input]
+    intermediate = np.asarray(sbox, dtype=np.uint8)[index]
+    table = np.asarray(LEAKAGE_MODELS[model](intermediate, sbox_input), dtype=np.uint8)
+    table.flags.writeable = False
+    return table
+
+def register_model(name):
+    """Decorator adding a model to the registry. The model takes the (256, 256) intermediate and
+    input arrays, indexed [textin byte, key guess], and returns values that fit in a uint8."""
+    def register(model):
+        LEAKAGE_MODELS[name] = model
+        # A model registered again under the same name must not be served from the old tables
+        _cached_table.cache_clear()
+        return model
+    return register
+
+@register_model("identity")
+def identity_model(intermediate, sbox_input):
+    return intermediate
+
+@register_model("hw")
+def hamming_weight_model(intermediate, sbox_input):
+    return HW_TABLE[intermediate]
+
+# Hamming distance between the s-box input and output, the leakage of the state being overwritten
+# in place by SubBytes
+@register_model("hd")
+def hamming_distance_model(intermediate, sbox_input):
+    return HW_TABLE[intermediate ^ sbox_input]
+
+def _bit_model(bitnum):
+    return lambda intermediate, sbox_input: (intermediate >> bitnum) & 1
+
+for _bitnum in range(8):
+    register_model(f"bit{_bitnum}")(_bit_model(_bitnum))
+
+
+def leakage_table(sbox, model="identity", sboxcomp=None):
+    """(256, 256) uint8 table of the model, indexed [textin byte, key guess]. Read only, as it is
+    shared through the cache."""
+    if model not in LEAKAGE_MODELS:
+        raise ValueError(f"Unknown leakage model {model}, expected one of {list(LEAKAGE_MODELS)}")
+    sbox = tuple(int(value) for value in sbox)
+    if sboxcomp is not None:
+        sboxcomp = tuple(int(value) for value in sboxcomp)
+    return _cached_table(sbox, model, sboxcomp)
+
+def selection_table(sbox, model, sboxcomp=None):
+    """leakage_table of a model used as the selection bit of DPA. Raises ValueError unless the model
+    only takes the values 0 and 1, as a multi-valued model like "hw" gives meaningless difference
+    of means scores."""
+    table = leakage_table(sbox, model, sboxcomp)
+    if table.max() > 1:
+        raise ValueError(f"Leakage model {model} is not a 0/1 selection, it takes values up to {table.max()}")
+    return table
@@ -52,3 +52,18 @@ naeusb_logger.handlers[1].setLevel(
 def set_all_log_levels(level):
     for logger in chipwhisperer_loggers:
         logger.handlers[0].setLevel(level)
+
+
+# Instrumentation events of instrumentation.py, one JSON object per line in their own file
+instrumentation_logger = logging.getLogger("ChipWhisperer Instrumentation")
+instrumentation_logger.setLevel(logging.INFO)
+instrumentation_logger.propagate = False
+
+def add_instrumentation_file(path=None):
+    if path is None:
+        path = os.path.join(log_dir, "chipwhisperer/logs", "instrumentation.jsonl")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    filehndlr = logging.FileHandler(path, mode="a")
+    filehndlr.setFormatter(logging.Formatter("%(message)s"))
+    instrumentation_logger.addHandler(filehndlr)
+    return filehndlr
@@ -1,105 +1,251 @@
-from tqdm import trange
+from functools import partial
 from chipwhisperer_minimal.helper_functions import *
 from chipwhisperer_minimal.sca_attacks import *
-import time
+from chipwhisperer_minimal.online_attacks import TVLAAccumulator
+from chipwhisperer_minimal.capture import ChipWhispererBackend
+from chipwhisperer_minimal.pipeline import run_batches
+from chipwhisperer_minimal.curves import count_grid, key_rank_curves, curve_table
+from chipwhisperer_minimal.poi import compress
+from chipwhisperer_minimal.instrumentation import span, count
 
 TOTAL_RUNS = 30
 TTEST_THRESHOLD = 4.5
 
 # metric_params = {
+#     "NAME" : str,
 #     "METRIC_HIGH" : int,
 #     "attack_function" : function,
 #     "TOTAL_RUNS" : int,
+#     "attack_factory" : function,    (instead of attack_function, for attacks that keep state)
+#     "PROFILE_TRACES" : int,    (profiled attacks only)
 # }
 
 # Create DPA and CPA structs
 dpa_metrics = {
     "METRIC_HIGH" : 4000,
+    "NAME" : "DPA",
     "attack_function" : dpa_run,
     "TOTAL_RUNS" : 10,
 }
 
 cpa_metrics = {
     "METRIC_HIGH" : 300,
+    "NAME" : "CPA",
     "attack_function" : cpa_run,
     "TOTAL_RUNS" : 30,
 }
 
+# Template attack, profiled on PROFILE_TRACES traces of the device with its known key before the
+# search. The attack traces are then captured apart from the profiling ones. A new TemplateAttack is
+# made for every num_traces call, so no templates are shared between sboxes, runs or workers.
+# The backends capture with the one known key, so the templates are profiled on the same device
+# and key they attack: the result is an upper bound, the best case of a template attack, not what
+# templates from another device or key would give.
+template_metrics = {
+    "METRIC_HIGH" : 300,
+    "NAME" : "TEMPLATE",
+    "attack_factory" : TemplateAttack,
+    "TOTAL_RUNS" : 30,
+    "PROFILE_TRACES" : 20000,
+}
+
 tvla_metrics = {
     "METRIC_HIGH" : 500,
+    "NAME" : "TVLA",
     "attack_function" : tvla_run,
     "TOTAL_RUNS" : 30,
 }
     
 
-def num_traces(sbox_name, sbox, platform = "CWNANO", metrics = dpa_metrics):
-    # Program the CW device
-    make_firmware(sbox_name, platform, c_target = 'TINYAES128C', scope_t = 'OPENADC', sbox2 = False, aes_mode="ECB")
-
-    #Pause for a second to generate the firmware
-    time.sleep(1)
-    setup_result = setup_scope_prog(platform)
-
-    print("Programming target")
-    hexname = f"simpleserial-aes-{platform}.hex"
-    cw.program_target(setup_result[0], setup_result[1], f"{current_dir}/firmware/simpleserial-aes/{hexname}")
+# Traces come from the given capture backend, a ChipWhisperer if none is given.
+# With a pool_size, one pool of traces is captured and every run draws a random subset of it
+# instead of capturing its own traces. The seed makes the draws reproducible.
+# With a ResultStore, every run is saved as it finishes, and a unit already in the store is resumed:
+# runs already done are not captured again, and a finished unit just returns its stored result.
+# With a Pipeline, the runs of each midpoint are captured and attacked concurrently.
+# With a StoppingRule (see sequential.py), each midpoint stops as soon as the rule settles whether
+# the success rate is reached, instead of always doing TOTAL_RUNS runs.
+# With a POISelector (see poi.py), the attacks only get the points of interest of the traces.
+# With instrumentation enabled (see instrumentation.py), capture and attack are timed per midpoint.
+def num_traces(sbox_name, sbox, platform = "CWNANO", metrics = dpa_metrics, pool_size = None, seed = None, backend = None, aes_mode = "ECB", store = None, pipeline = None, stopping = None, poi_selector = None):
+    unit = (sbox_name, platform, metrics["NAME"], aes_mode)
+    if store is not None and store.result(unit) is not None:
+        return int(store.result(unit))
+    tags = dict(sbox=sbox_name, device=platform, method=metrics["NAME"], aes_mode=aes_mode)
 
+    # Program the CW device, or whatever the backend captures from
+    if backend is None:
+        backend = ChipWhispererBackend()
+    backend.prepare(sbox_name, platform, aes_mode=aes_mode)
 
+    from tqdm import tqdm
     # If no metric high given, define it
     hi = metrics["METRIC_HIGH"]
     first_hi = hi
     lo = 0
-    known_key = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
+
+    if poi_selector is not None:
+        pois = poi_selector.pois(backend, sbox_name, platform, aes_mode)
+
+    def capture_traces(N, midpoint=None):
+        with span("capture", traces=N, midpoint=midpoint, **tags):
+            textin_array, trace_array = backend.capture(N)
+        if poi_selector is not None:
+            trace_array = compress(trace_array, pois)
+        return textin_array, trace_array
+
+    # A fresh attack for this call, the metrics dict being shared by every sbox
+    attack_function = metrics["attack_factory"]() if "attack_factory" in metrics else metrics["attack_function"]
+    if "PROFILE_TRACES" in metrics:
+        profiling = capture_traces(metrics["PROFILE_TRACES"])
+        with span("profile", traces=metrics["PROFILE_TRACES"], **tags):
+            attack_function.profile(sbox, *profiling, list(backend.key))
+        del profiling
+
+    if pool_size:
+        pool = capture_traces(max(pool_size, hi))
+        rng = np.random.default_rng(seed)
 
     while (abs(hi - lo) > 1):
         midpoint = (hi + lo)//2 
-        counter = 0
-        for i in trange(0, metrics["TOTAL_RUNS"], desc=f"Calculating {sbox_name} using {midpoint} traces", leave=False):
-            textin_array, trace_array = gather_n_traces(setup_result, N=midpoint)
+        total_runs = metrics["TOTAL_RUNS"]
+        done = store.runs(unit, midpoint) if store is not None else {}
+        runs = [i for i in range(total_runs) if i not in done]
+        counter = sum(int(done[i]) for i in range(total_runs) if i in done)
+        runs_done = total_runs - len(runs)
+        decision = stopping.decide(counter, runs_done, total_runs) if stopping is not None else None
+
+        if pool_size:
+            capture = lambda i: draw_from_pool(pool, midpoint, rng)
+        else:
+            capture = lambda i: capture_traces(midpoint, midpoint)
+        analyse = partial(key_recovered, attack_function, sbox, list(backend.key), tags=dict(tags, midpoint=midpoint))
+        outcomes = run_batches(capture, analyse, runs if decision is None else [], pipeline)
+        for i, success in tqdm(outcomes, total=len(runs), desc=f"Calculating {sbox_name} using {midpoint} traces", leave=False):
+            counter += success
+            runs_done += 1
+            count("runs", midpoint=midpoint, **tags)
+            if store is not None:
+                store.record_run(unit, midpoint, i, success)
+            if stopping is not None:
+                decision = stopping.decide(counter, runs_done, total_runs)
+                if decision is not None:
+                    break
+        # Stops the batches captured ahead by a pipeline
+        outcomes.close()
 
-            key_guess = metrics["attack_function"](sbox, textin_array, trace_array)
-            if key_guess == known_key:
-                counter += 1
+        if stopping is None:
+            decision = counter >= .9 * total_runs
+        else:
+            stopping.record(midpoint, counter, runs_done, total_runs, decision)
         # print(counter)
-        if counter >= .9 * metrics["TOTAL_RUNS"]:
+        if decision:
             hi = midpoint
         elif hi == first_hi:
             print(F"No break with upper bound of {first_hi}!")
-            setup_result[0].dis()
+            backend.close()
+            if store is not None:
+                store.record_result(unit, -1)
             return -1
         else:
             lo = midpoint
         # print(f"After: lo, hi = {lo}, {hi}")
 
     # Disconnects the CW device
-    setup_result[0].dis()
+    backend.close()
+    if store is not None:
+        store.record_result(unit, hi)
     return hi
 
+# Whether the attack recovers the key from the traces. The tags label the attack span.
+def key_recovered(attack_function, sbox, key, textin_array, trace_array, tags=None):
+    with span("attack", traces=len(trace_array), **(tags or {})):
+        return attack_function(sbox, textin_array, trace_array) == key
 
-# Function for metric of TVLA
-def tvla(sbox_name, platform = "CWNANO", metrics = tvla_metrics, aes_mode=None):
-    # Make the firmware for the sbox and setup the device
-    make_firmware(sbox_name, platform, c_target = 'TINYAES128C', scope_t = 'OPENADC', sbox2 = False, aes_mode=aes_mode)
+# TVLA of the fixed and random traces of one run, as key_recovered
+def leakage_detected(attack_function, fixed_t, random_t, tags=None):
+    with span("attack", traces=len(fixed_t) + len(random_t), **(tags or {})):
+        return attack_function(fixed_t, random_t, threshold=TTEST_THRESHOLD)
 
-    #Pause for a second to generate the firmware
-    time.sleep(1)
-    setup_result = setup_scope_prog(platform)
 
-    print("Programming target")
-    hexname = f"simpleserial-aes-{platform}.hex"
-    cw.program_target(setup_result[0], setup_result[1], f"{current_dir}/firmware/simpleserial-aes/{hexname}")
+# Success rate and guessing entropy curves of an attack, from one pool of pool_size traces and
+# `permutations` incremental passes over it (see curves.py). Returns the curve table, whose
+# traces_for_success is the counterpart of num_traces.
+def success_curves(sbox_name, sbox, platform = "CWNANO", method = "CPA", pool_size = 1000, counts = None, permutations = 100, seed = None, backend = None, aes_mode = "ECB"):
+    if backend is None:
+        backend = ChipWhispererBackend()
+    backend.prepare(sbox_name, platform, aes_mode=aes_mode)
+    textin_array, trace_array = backend.capture(pool_size)
+    backend.close()
 
-    percentage_leaks = [] 
+    if counts is None:
+        counts = count_grid(pool_size)
+    ranks = key_rank_curves(sbox, textin_array, trace_array, list(backend.key), counts, permutations, method, seed)
+    return curve_table(sorted(counts), ranks)
 
-    for i in trange(0, TOTAL_RUNS, desc=f"TVLA on {sbox_name}", leave=False):
-        fixed_t, random_t = tvla_gather_n_traces(setup_result, N=metrics["METRIC_HIGH"])
-        percentage_leak = metrics["attack_function"](fixed_t, random_t, TTEST_THRESHOLD)
 
+# Function for metric of TVLA
+# Traces come from the given capture backend, a ChipWhisperer if none is given.
+# With a batch_size, traces are captured in batches and streamed into a TVLAAccumulator, so memory
+# does not grow with METRIC_HIGH
+# With a ResultStore, the runs are saved and resumed as in num_traces
+# With a Pipeline, and no batch_size, the runs are captured and tested concurrently
+def tvla(sbox_name, platform = "CWNANO", metrics = tvla_metrics, aes_mode=None, batch_size=None, backend=None, store=None, pipeline=None):
+    unit = (sbox_name, platform, metrics["NAME"], aes_mode)
+    if store is not None and store.result(unit) is not None:
+        return store.result(unit)
+    tags = dict(sbox=sbox_name, device=platform, method=metrics["NAME"], aes_mode=aes_mode)
+
+    # Make the firmware for the sbox and setup the device
+    if backend is None:
+        backend = ChipWhispererBackend()
+    backend.prepare(sbox_name, platform, aes_mode=aes_mode)
+
+    from tqdm import tqdm
+    done = store.runs(unit, metrics["METRIC_HIGH"]) if store is not None else {}
+    runs = [i for i in range(TOTAL_RUNS) if i not in done]
+    percentage_leaks = [done[i] for i in range(TOTAL_RUNS) if i in done]
+
+    if batch_size:
+        outcomes = ((i, tvla_streaming(backend, metrics["METRIC_HIGH"], batch_size, tags)) for i in runs)
+    else:
+        capture = lambda i: capture_tvla(backend, metrics["METRIC_HIGH"], tags)
+        analyse = partial(leakage_detected, metrics["attack_function"], tags=tags)
+        outcomes = run_batches(capture, analyse, runs, pipeline, count=lambda groups: len(groups[0]) + len(groups[1]))
+
+    for i, percentage_leak in tqdm(outcomes, total=len(runs), desc=f"TVLA on {sbox_name}", leave=False):
         percentage_leaks.append(percentage_leak)
+        count("runs", **tags)
+        if store is not None:
+            store.record_run(unit, metrics["METRIC_HIGH"], i, percentage_leak)
 
-    setup_result[0].dis()
+    backend.close()
     # Return the average percent leaks
-    return np.mean(percentage_leaks)
+    avg_percent_leaks = np.mean(percentage_leaks)
+    if store is not None:
+        store.record_result(unit, avg_percent_leaks)
+    return avg_percent_leaks
+
+# One TVLA run captured in batches. As in tvla_run, the first half of the traces forms the first
+# split and the second half the second split.
+def tvla_streaming(backend, N, batch_size, tags=None):
+    accumulator = TVLAAccumulator()
+    half = N // 2
+    for split, split_len in enumerate([half, N - half]):
+        captured = 0
+        while captured < split_len:
+            n = min(batch_size, split_len - captured)
+            fixed_t, random_t = capture_tvla(backend, n, tags)
+            with span("accumulate", traces=2 * n, **(tags or {})):
+                accumulator.add_traces(fixed_t, random_t, split)
+            captured += n
+    with span("attack", **(tags or {})):
+        return accumulator.percentage_leaks(TTEST_THRESHOLD)
+
+# N fixed and N random traces from the backend
+def capture_tvla(backend, N, tags=None):
+    with span("capture", traces=2 * N, **(tags or {})):
+        return backend.capture_tvla(N)
 
 ## current_result = sum of 60 values/60 = sum([0,...,0, r_1, ..., r_30])/60
 
@@ -0,0 +1,171 @@
+import numpy as np
+from chipwhisperer_minimal.sca_attacks import count_leaks, hypothesis_matrix
+from chipwhisperer_minimal.leakage_models import selection_table
+
+# Online versions of cpa_run and dpa_run. Instead of recomputing the attack for every trace count,
+# the accumulators keep running sums and can rank the key guesses after any number of batches.
+
+class _KeyRanking:
+    """Key ranking of an accumulator from its (bytes, 256) scores(), the highest score first"""
+
+    # (bytes, 256) key guesses of each byte, most likely first
+    def key_ranking(self):
+        return np.argsort(self.scores(), axis=1)[:, ::-1]
+
+    def key_guess(self):
+        return list(self.key_ranking()[:, 0])
+
+    # Position of the known key byte in the ranking of each byte, 0 meaning recovered
+    def key_ranks(self, known_key):
+        ranking = self.key_ranking()
+        known = np.asarray([known_key[bnum] for bnum in self.byteindices])
+        return np.argmax(ranking == known[:, None], axis=1)
+
+
+class CPAAccumulator(_KeyRanking):
+    """Running moments for CPA, h being the named leakage model of every guess: the mean and sum of
+    squared deviations of t and of h, kept by WelfordAccumulators, and the co-moment sum((h - mean h)
+    (t - mean t)). Every batch is centered on its own means and merged as in WelfordAccumulator,
+    so the correlation does not lose precision to the raw sums of squares over many traces."""
+
+    def __init__(self, sbox, byteindices=range(16), dtype=np.float64, model="hw"):
+        self.sbox = sbox
+        self.byteindices = list(byteindices)
+        self.dtype = dtype
+        self.model = model
+        self.n = 0
+        self.t_moments = WelfordAccumulator()
+        self.h_moments = [WelfordAccumulator() for _ in self.byteindices]
+        self.comoment = None
+
+    def add_traces(self, textin_array, trace_array):
+        textins = np.asarray(textin_array, dtype=np.uint8)
+        traces = np.asarray(trace_array, dtype=self.dtype)
+        batch_n = traces.shape[0]
+        if batch_n == 0:
+            return
+        if self.comoment is None:
+            self.comoment = np.zeros((len(self.byteindices), 256, traces.shape[1]), dtype=self.dtype)
+
+        total = self.n + batch_n
+        batch_mean_t = traces.mean(axis=0, dtype=np.float64)
+        t_centered = traces - batch_mean_t.astype(self.dtype)
+        delta_t = batch_mean_t - self.t_moments.mean
+        for i, bnum in enumerate(self.byteindices):
+            hws = hypothesis_matrix(self.sbox, textins, bnum, self.model).astype(self.dtype)
+            batch_mean_h = hws.mean(axis=0, dtype=np.float64)
+            delta_h = batch_mean_h - self.h_moments[i].mean
+            # Co-moment of the batch about its own means, plus the shift between the two means
+            self.comoment[i] += (hws - batch_mean_h.astype(self.dtype)).T @ t_centered
+            self.comoment[i] += (np.outer(delta_h, delta_t) * (self.n * batch_n / total)).astype(self.dtype)
+            self.h_moments[i].add_traces(hws)
+        self.t_moments.add_traces(traces)
+        self.n = total
+
+    # (bytes, 256) peak absolute correlation of each guess
+    def scores(self):
+        var_t = self.t_moments.m2
+        var_h = np.asarray([moments.m2 for moments in self.h_moments])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = self.comoment / np.sqrt(var_h[:, :, None] * var_t[None, None, :])
+        return np.nan_to_num(np.abs(correlation)).max(axis=2)
+
+
+class DPAAccumulator(_KeyRanking):
+    """Running per-partition sums for DPA: sum(t) over all traces and over the traces whose
+    selection bit is set, for every guess. The selection is bit `bitnum` of the s-box output, or any
+    0/1 leakage model given by name, ValueError being raised for a model with other values."""
+
+    def __init__(self, sbox, byteindices=range(16), bitnum=0, dtype=np.float64, model=None):
+        self.sbox = sbox
+        self.byteindices = list(byteindices)
+        self.bitnum = bitnum
+        self.dtype = dtype
+        self.model = model or f"bit{bitnum}"
+        selection_table(sbox, self.model)
+        self.n = 0
+        self.sum_t = None
+        self.one_count = np.zeros((len(self.byteindices), 256), dtype=np.int64)
+        self.one_sum = None
+
+    def add_traces(self, textin_array, trace_array):
+        textins = np.asarray(textin_array, dtype=np.uint8)
+        traces = np.asarray(trace_array, dtype=self.dtype)
+        if traces.shape[0] == 0:
+            return
+        if self.sum_t is None:
+            self.sum_t = np.zeros(traces.shape[1], dtype=self.dtype)
+            self.one_sum = np.zeros((len(self.byteindices), 256, traces.shape[1]), dtype=self.dtype)
+
+        self.n += traces.shape[0]
+        self.sum_t += traces.sum(axis=0)
+        for i, subkey in enumerate(self.byteindices):
+            selection = hypothesis_matrix(self.sbox, textins, subkey, self.model)
+            self.one_count[i] += selection.sum(axis=0, dtype=np.int64)
+            self.one_sum[i] += selection.T.astype(self.dtype) @ traces
+
+    # (bytes, 256) peak difference of means of each guess, nan for an empty group like dpa_run
+    def scores(self):
+        one_count = self.one_count[:, :, None]
+        zero_count = self.n - one_count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            diffs = np.abs(self.one_sum / one_count - (self.sum_t - self.one_sum) / zero_count)
+        return np.max(diffs, axis=2)
+
+
+class WelfordAccumulator:
+    """Per-sample running mean and sum of squared deviations, merged one batch at a time"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add_traces(self, trace_array):
+        traces = np.asarray(trace_array, dtype=np.float64)
+        batch_n = traces.shape[0]
+        if batch_n == 0:
+            return
+        batch_mean = traces.mean(axis=0)
+        batch_m2 = ((traces - batch_mean)**2).sum(axis=0)
+
+        total = self.n + batch_n
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * batch_n / total
+        self.m2 = self.m2 + batch_m2 + delta**2 * self.n * batch_n / total
+        self.n = total
+
+    # Sample variance, as used by the Welch t-test. NaN with less than two traces, where it is not
+    # defined.
+    def variance(self):
+        if self.n < 2:
+            return np.full(np.shape(self.m2), np.nan)
+        return self.m2 / (self.n - 1)
+
+
+class TVLAAccumulator:
+    """Streaming version of tvla_run: fixed and random traces are added in batches to one of the
+    two splits, and only the per-sample means and variances are kept"""
+
+    def __init__(self):
+        # groups[split][0] holds the fixed traces, groups[split][1] the random ones
+        self.groups = [[WelfordAccumulator(), WelfordAccumulator()] for _ in range(2)]
+
+    def add_traces(self, fixed_traces, random_traces, split):
+        self.groups[split][0].add_traces(fixed_traces)
+        self.groups[split][1].add_traces(random_traces)
+
+    # (2, samples) Welch t-statistics, one row per split. NaN, which never counts as a leak, for a
+    # split with less than two traces in a group.
+    def t_statistics(self):
+        t = []
+        for fixed, random in self.groups:
+            if fixed.n < 2 or random.n < 2:
+                t.append(np.full(np.shape(fixed.m2 + random.m2), np.nan))
+                continue
+            t.append((fixed.mean - random.mean) / np.sqrt(fixed.variance()/fixed.n + random.variance()/random.n))
+        return np.asarray(t)
+
+    def percentage_leaks(self, threshold):
+        return count_leaks(self.t_statistics(), threshold)
+
@@ -0,0 +1,207 @@
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from chipwhisperer_minimal.sca_attacks import hypothesis_matrix
+from chipwhisperer_minimal.leakage_models import selection_table
+
+# Sharded versions of cpa_engine and dpa_engine for large trace sets. The attack is split into one
+# task per (key byte, window of samples) and run on a process pool. The traces are not pickled to
+# the workers: they are put once in shared memory, or, for a memmap (e.g. from a TraceStore), the
+# workers map the same file. Every sample is attacked independently of the others, so the windows
+# are merged by taking the peak over them, and the result is the one of the single process engines.
+#
+# Starting the pool costs far more than a small attack, so an AttackPool is meant to be started once
+# and used for every attack of a num_traces or campaign run, then shut down:
+#
+#   with AttackPool() as pool:
+#       num_traces(sbox_name, sbox, metrics=dict(cpa_metrics, attack_function=pool.cpa_run))
+#
+# The sharded_* functions take a pool too, and start one of their own for the call without it.
+
+# Arrays of the attack the worker last took part in, set by _attach, and the last sample window its
+# tasks computed, which the tasks of the other bytes reuse. Only one window is kept, so a worker never
+# holds more than one window's copy of the shared traces.
+_worker = {"call": None, "blocks": [], "window": None}
+
+# Position in its file of a contiguous memmap, None if the array can not be mapped again as is. The
+# offset attribute of a slice of a memmap is the one of the whole map, so the position is found from
+# the address of the slice in the memmap it was taken from.
+def _file_offset(trace_array):
+    if not trace_array.filename or not trace_array.flags.c_contiguous:
+        return None
+    mapped = trace_array
+    while isinstance(mapped.base, np.memmap):
+        mapped = mapped.base
+    return mapped.offset + trace_array.ctypes.data - mapped.ctypes.data
+
+def _share(trace_array):
+    """Descriptor the workers can open the traces from, and the shared memory block to release"""
+    offset = _file_offset(trace_array) if isinstance(trace_array, np.memmap) else None
+    if offset is not None:
+        return ("memmap", trace_array.filename, offset, trace_array.shape, trace_array.dtype.str), None
+    traces = np.ascontiguousarray(trace_array)
+    block = shared_memory.SharedMemory(create=True, size=max(traces.nbytes, 1))
+    np.ndarray(traces.shape, dtype=traces.dtype, buffer=block.buf)[:] = traces
+    return ("shm", block.name, 0, traces.shape, traces.dtype.str), block
+
+def _open(descriptor):
+    kind, name, offset, shape, dtype = descriptor
+    if kind == "memmap":
+        return np.memmap(name, dtype=dtype, mode="r", offset=offset, shape=shape), None
+    block = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf), block
+
+# Opens the arrays of an attack in the worker, once per attack. The blocks are kept so the buffers
+# stay mapped until the next attack.
+def _attach(call):
+    call_id, trace_descriptor, textin_descriptor, sbox, model, dtype = call
+    if _worker["call"] != call_id:
+        for block in _worker["blocks"]:
+            if block is not None:
+                block.close()
+        traces, trace_block = _open(trace_descriptor)
+        textins, textin_block = _open(textin_descriptor)
+        _worker.update(call=call_id, traces=traces, textins=textins, blocks=[trace_block, textin_block],
+                       sbox=sbox, model=model, dtype=dtype, window=None)
+
+# The window of the traces as computed by prepare(traces), computed again unless it is the worker's
+# last window
+def _window(start, stop, prepare):
+    if _worker["window"] is None or _worker["window"][0] != (start, stop):
+        # The last window is dropped before the next one is made
+        _worker["window"] = None
+        traces = np.asarray(_worker["traces"][:, start:stop], dtype=_worker["dtype"])
+        _worker["window"] = ((start, stop), prepare(traces))
+    return _worker["window"][1]
+
+def _centered(traces):
+    t_centered = traces - traces.mean(axis=0)
+    return t_centered, np.sqrt(np.sum(t_centered**2, axis=0))
+
+def _with_sum(traces):
+    return traces, traces.sum(axis=0)
+
+def _cpa_task(call, bnum, start, stop):
+    _attach(call)
+    t_centered, o_t = _window(start, stop, _centered)
+
+    hws = hypothesis_matrix(_worker["sbox"], _worker["textins"], bnum, _worker["model"]).astype(_worker["dtype"])
+    h_centered = hws - hws.mean(axis=0)
+    o_hws = np.sqrt(np.sum(h_centered**2, axis=0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = (h_centered.T @ t_centered) / np.outer(o_hws, o_t)
+    return np.nan_to_num(np.abs(correlation)).max(axis=1)
+
+def _dpa_task(call, bnum, start, stop):
+    _attach(call)
+    traces, total_sum = _window(start, stop, _with_sum)
+    selection = hypothesis_matrix(_worker["sbox"], _worker["textins"], bnum, _worker["model"])
+    one_sum = selection.T.astype(_worker["dtype"]) @ traces
+    one_count = selection.sum(axis=0, dtype=np.int64)[:, None]
+    zero_count = traces.shape[0] - one_count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        full_diffs = np.abs(one_sum / one_count - (total_sum - one_sum) / zero_count)
+    return np.max(full_diffs, axis=1)
+
+# Sample windows, about 4 tasks per worker over all the bytes
+def sample_windows(samples, workers, byte_count=16, window_size=None):
+    if window_size is None:
+        windows = max(1, math.ceil(4 * workers / byte_count))
+        window_size = math.ceil(samples / windows)
+    return [(start, min(start + window_size, samples)) for start in range(0, samples, window_size)]
+
+class AttackPool:
+    """Process pool of `workers` processes for the sharded attacks, reused by every attack it runs.
+    Shut it down with shutdown(), or use it as a context manager. It can not be sent to another
+    process."""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.calls = itertools.count()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.shutdown()
+        return False
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def scores(self, task, sbox, textin_array, trace_array, byteindices, model, dtype=np.float64, window_size=None):
+        """(bytes, 256) peak score of every guess of each byte, every byte and sample window being
+        one task"""
+        byteindices = list(byteindices)
+        windows = sample_windows(np.shape(trace_array)[1], self.workers, len(byteindices), window_size)
+        trace_descriptor, trace_block = _share(trace_array)
+        textin_descriptor, textin_block = _share(np.asarray(textin_array, dtype=np.uint8))
+        try:
+            # Calls are numbered per process, the pid keeps them apart from other processes' calls
+            call = ((os.getpid(), next(self.calls)), trace_descriptor, textin_descriptor, list(sbox), model, dtype)
+            # Submitted window by window, so the tasks a worker takes in a row mostly share its window
+            futures = {(bnum, window): self.executor.submit(task, call, bnum, *window) for window in windows for bnum in byteindices}
+            # (bytes, 256) peak over every window of each guess. np.maximum keeps a nan, as np.max does
+            scores = np.stack([
+                np.maximum.reduce([futures[bnum, window].result() for window in windows]) for bnum in byteindices
+            ])
+        finally:
+            for block in [trace_block, textin_block]:
+                if block is not None:
+                    block.close()
+                    block.unlink()
+        return scores
+
+    def cpa_engine(self, sbox, textin_array, trace_array, dtype=np.float64, model="hw", window_size=None):
+        """cpa_engine on the pool. Returns the key guess and the peak absolute correlation of each
+        byte."""
+        scores = self.scores(_cpa_task, sbox, textin_array, trace_array, range(16), model, dtype, window_size)
+        key_guess = list(np.argmax(scores, axis=1))
+        return key_guess, scores[np.arange(16), key_guess]
+
+    def dpa_engine(self, sbox, textin_array, trace_array, bitnum=0, byteindices=range(16), dtype=np.float64, model=None, window_size=None):
+        """dpa_engine on the pool. Raises ValueError for a model that is not a 0/1 selection."""
+        byteindices = list(byteindices)
+        model = model or f"bit{bitnum}"
+        selection_table(sbox, model)
+        scores = self.scores(_dpa_task, sbox, textin_array, trace_array, byteindices, model, dtype, window_size)
+        # Same tie and nan order as dpa_engine
+        key_guess = [np.argsort(max_diffs)[::-1][0] for max_diffs in scores]
+        return key_guess, scores[np.arange(len(byteindices)), key_guess]
+
+    # attack_function versions, as cpa_run and dpa_run
+    def cpa_run(self, sbox, textin_array, trace_array, dtype=np.float64, model="hw"):
+        key_guess, _ = self.cpa_engine(sbox, textin_array, trace_array, dtype, model)
+        return key_guess
+
+    def dpa_run(self, sbox, textin_array, trace_array, bitnum=0, dtype=np.float64, model=None):
+        key_guess, _ = self.dpa_engine(sbox, textin_array, trace_array, bitnum, dtype=dtype, model=model)
+        return key_guess
+
+
+def sharded_cpa_engine(sbox, textin_array, trace_array, dtype=np.float64, model="hw", workers=None, window_size=None, pool=None):
+    """cpa_engine on the pool, or on a pool of `workers` processes started for this call. Returns the
+    key guess and the peak absolute correlation of each byte."""
+    if pool is None:
+        with AttackPool(workers) as pool:
+            return pool.cpa_engine(sbox, textin_array, trace_array, dtype, model, window_size)
+    return pool.cpa_engine(sbox, textin_array, trace_array, dtype, model, window_size)
+
+def sharded_dpa_engine(sbox, textin_array, trace_array, bitnum=0, byteindices=range(16), dtype=np.float64, model=None, workers=None, window_size=None, pool=None):
+    """dpa_engine on a process pool, as sharded_cpa_engine"""
+    if pool is None:
+        with AttackPool(workers) as pool:
+            return pool.dpa_engine(sbox, textin_array, trace_array, bitnum, byteindices, dtype, model, window_size)
+    return pool.dpa_engine(sbox, textin_array, trace_array, bitnum, byteindices, dtype, model, window_size)
+
+def sharded_cpa_run(sbox, textin_array, trace_array, dtype=np.float64, model="hw", workers=None, pool=None):
+    key_guess, _ = sharded_cpa_engine(sbox, textin_array, trace_array, dtype, model, workers, pool=pool)
+    return key_guess
+
+def sharded_dpa_run(sbox, textin_array, trace_array, bitnum=0, dtype=np.float64, model=None, workers=None, pool=None):
+    key_guess, _ = sharded_dpa_engine(sbox, textin_array, trace_array, bitnum, dtype=dtype, model=model, workers=workers, pool=pool)
+    return key_guess
@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Pipelined capture and analysis. One capture thread fills a bounded queue with trace batches while a
+# pool of analysis workers consumes them, so the scope keeps capturing while the previous batches are
+# being attacked. The capture callable is only ever called from the capture thread, so a backend does
+# not need to be thread-safe. A full queue blocks the capture thread, which bounds the memory used.
+
+_DONE = object()
+
+# Runs in the analysis worker, so the time measured is the analysis alone
+def _timed(analyse, batch):
+    start = time.perf_counter()
+    result = analyse(*batch)
+    return result, time.perf_counter() - start
+
+
+class PipelineStats:
+    """Counters of a pipeline, summed over every map() call"""
+
+    def __init__(self):
+        self.batches = 0
+        self.traces = 0
+        self.capture_seconds = 0.0
+        self.analysis_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.queue_depth_sum = 0
+        self.queue_depth_max = 0
+        self.lock = threading.Lock()
+
+    def summary(self):
+        """Throughput of each stage in traces per second of its busy time, overall throughput, and the
+        depth of the batch queue seen by the analysis stage. A queue that is mostly empty means the
+        capture is the bottleneck, a queue that is mostly full means the analysis is."""
+        def rate(seconds):
+            return self.traces / seconds if seconds else 0.0
+        return {
+            "batches": self.batches,
+            "traces": self.traces,
+            "capture_traces_per_s": rate(self.capture_seconds),
+            "analysis_traces_per_s": rate(self.analysis_seconds),
+            "traces_per_s": rate(self.wall_seconds),
+            "capture_seconds": self.capture_seconds,
+            "analysis_seconds": self.analysis_seconds,
+            "wall_seconds": self.wall_seconds,
+            "queue_depth_mean": self.queue_depth_sum / self.batches if self.batches else 0.0,
+            "queue_depth_max": self.queue_depth_max,
+        }
+
+
+class Pipeline:
+    """Overlaps the capture of trace batches with their analysis.
+
+    queue_size is the number of captured batches that may wait for analysis, and workers the number
+    of batches analysed at once. executor is "thread" or "process": NumPy releases the GIL in the
+    attacks, so threads are usually enough and avoid copying the traces to another process. With
+    processes, the analyse callable must be picklable."""
+
+    def __init__(self, queue_size=4, workers=2, executor="thread"):
+        if executor not in ["thread", "process"]:
+            raise ValueError(f"Unknown executor {executor}, expected `thread` or `process`")
+        self.queue_size = queue_size
+        self.workers = workers
+        self.executor = executor
+        self.stats = PipelineStats()
+
+    def map(self, capture, analyse, jobs, count=lambda batch: len(batch[0])):
+        """Yields (job, analyse(*capture(job))) for every job, in order.
+
+        capture(job) returns a tuple of arrays, and count(batch) the number of traces in it. Batches
+        keep being captured while the results are consumed, so leaving the loop early throws away
+        the batches captured ahead."""
+        jobs = list(jobs)
+        batches = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        stats = self.stats
+
+        def put(item):
+            # Gives up once the consumer is gone, so the thread never blocks on a full queue forever
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for job in jobs:
+                    if stop.is_set():
+                        return
+                    start = time.perf_counter()
+                    batch = capture(job)
+                    with stats.lock:
+                        stats.capture_seconds += time.perf_counter() - start
+                    if not put((job, batch)):
+                        return
+            except BaseException as e:
+                put((None, e))
+                return
+            put(_DONE)
+
+        start = time.perf_counter()
+        producer = threading.Thread(target=produce, name="capture", daemon=True)
+        pool = ThreadPoolExecutor(self.workers) if self.executor == "thread" else ProcessPoolExecutor(self.workers)
+        running = deque()
+        try:
+            producer.start()
+            finished = False
+            while not finished or running:
+                # Keep every worker busy, then hand back the oldest result
+                while not finished and len(running) < self.workers:
+                    depth = batches.qsize()
+                    item = batches.get()
+                    if item is _DONE:
+                        finished = True
+                        break
+                    job, batch = item
+                    if isinstance(batch, BaseException):
+                        raise batch
+                    stats.queue_depth_sum += depth
+                    stats.queue_depth_max = max(stats.queue_depth_max, depth)
+                    stats.batches += 1
+                    stats.traces += count(batch)
+                    running.append((job, pool.submit(_timed, analyse, batch)))
+                if running:
+                    job, future = running.popleft()
+                    result, seconds = future.result()
+                    stats.analysis_seconds += seconds
+                    yield job, result
+        finally:
+            stop.set()
+            for _, future in running:
+                future.cancel()
+            pool.shutdown(wait=True)
+            producer.join()
+            stats.wall_seconds += time.perf_counter() - start
+
+
+# Yields (job, analyse(*capture(job))) for every job, through the pipeline if one is given, else
+# capturing and analysing one job after the other
+def run_batches(capture, analyse, jobs, pipeline=None, count=lambda batch: len(batch[0])):
+    if pipeline is not None:
+        yield from pipeline.map(capture, analyse, jobs, count)
+        return
+    for job in jobs:
+        yield job, analyse(*capture(job))
@@ -0,0 +1,130 @@
+import json
+import os
+import numpy as np
+
+# Points of interest. The first round S-box leakage of AES only spans a small part of a trace, so the
+# samples that leak are found once per device and firmware from a profiling set of traces, and the
+# attacks then only get those samples. The cost of cpa_run and dpa_run is linear in the number of
+# samples, so it drops by the compression ratio.
+#
+# A sample is scored per key byte by how well the plaintext byte separates the traces. With a fixed
+# key the plaintext byte determines every first round intermediate of that byte, so no key is
+# needed to find the points.
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+POI_CACHE_DIR = f"{current_dir}/poi_cache"
+
+# Per-class count, mean and variance of every byte of the textins, the classes of a byte being its
+# values. Yields one (counts, means, variances) per byte.
+def class_statistics(textin_array, trace_array, byteindices=range(16)):
+    from scipy import sparse
+    traces = np.asarray(trace_array, dtype=np.float64)
+    textins = np.asarray(textin_array, dtype=np.uint8)
+    byteindices = list(byteindices)
+    n, b = len(traces), len(byteindices)
+
+    # (bytes * 256, N) sparse indicator of the class of every trace for every byte, so that one
+    # product gives the class sums of all the bytes, in time linear in the number of traces
+    rows = (np.arange(b) * 256)[None, :] + textins[:, byteindices].astype(np.int64)
+    indicator = sparse.csc_matrix((np.ones(n * b), (rows.ravel(), np.repeat(np.arange(n), b))), shape=(b * 256, n))
+    counts = np.bincount(rows.ravel(), minlength=b * 256).astype(np.float64)
+    sums = indicator @ traces
+    squares = indicator @ traces**2
+    for i in range(b):
+        block = slice(i * 256, (i + 1) * 256)
+        yield _byte_statistics(counts[block], sums[block], squares[block])
+
+def _byte_statistics(counts, sums, squares):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts[:, None]
+        variances = squares / counts[:, None] - means**2
+    # Classes seen less than twice have no variance
+    present = counts >= 2
+    return counts[present], means[present], np.maximum(variances[present], 0)
+
+def snr(textin_array, trace_array, byteindices=range(16)):
+    """(bytes, samples) signal to noise ratio: variance of the class means over the mean of the class
+    variances"""
+    scores = []
+    for counts, means, variances in class_statistics(textin_array, trace_array, byteindices):
+        weights = counts / counts.sum()
+        signal = (weights[:, None] * (means - weights @ means)**2).sum(axis=0)
+        noise = weights @ variances
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores.append(np.nan_to_num(signal / noise))
+    return np.asarray(scores)
+
+def sost(textin_array, trace_array, byteindices=range(16)):
+    """(bytes, samples) sum of squared pairwise t-differences: the sum over pairs of classes i < j of
+    (m_i - m_j)^2 / (v_i/n_i + v_j/n_j)"""
+    scores = []
+    for counts, means, variances in class_statistics(textin_array, trace_array, byteindices):
+        spread = variances / counts[:, None]
+        score = np.zeros(means.shape[1])
+        for i in range(len(counts) - 1):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t2 = (means[i] - means[i+1:])**2 / (spread[i] + spread[i+1:])
+            score += np.nan_to_num(t2).sum(axis=0)
+        scores.append(score)
+    return np.asarray(scores)
+
+POI_METHODS = {
+    "snr": snr,
+    "sost": sost,
+}
+
+def select_pois(scores, k=5, window=0):
+    """Sorted sample indices of the k best samples of every byte, each widened to the samples up to
+    `window` away, merged over the bytes"""
+    scores = np.atleast_2d(scores)
+    samples = scores.shape[1]
+    best = np.argsort(scores, axis=1)[:, ::-1][:, :k].ravel()
+    offsets = np.arange(-window, window + 1)
+    pois = (best[:, None] + offsets[None, :]).ravel()
+    return np.unique(pois[(pois >= 0) & (pois < samples)])
+
+def compress(trace_array, pois):
+    return np.ascontiguousarray(np.asarray(trace_array)[:, pois])
+
+
+class POISelector:
+    """Finds the points of interest of a prepared backend and caches them on disk.
+
+    The points are kept per device and firmware image: a backend that knows the image it runs (e.g.
+    ChipWhispererBackend, through firmware_id) shares the points of every capture with that image,
+    others are keyed by backend type, sbox, platform and AES mode.
+
+    Only ECB is supported: the classes are the plaintext bytes, which are the cipher input in ECB
+    only. In CBC they are xored with the IV first, and in CTR they never enter the cipher."""
+
+    def __init__(self, k=5, window=0, method="snr", profile_traces=5000, cache_dir=POI_CACHE_DIR):
+        if method not in POI_METHODS:
+            raise ValueError(f"Unknown POI method {method}, expected one of {list(POI_METHODS)}")
+        self.k = k
+        self.window = window
+        self.method = method
+        self.profile_traces = profile_traces
+        self.cache_dir = cache_dir
+
+    def cache_path(self, backend, sbox_name, platform, aes_mode):
+        firmware = backend.firmware_id or f"{type(backend).__name__}_{sbox_name}_{aes_mode or 'ECB'}"
+        return os.path.join(self.cache_dir, f"{platform.lower()}_{firmware}_{self.method}_{self.k}_{self.window}.json")
+
+    def pois(self, backend, sbox_name, platform="CWNANO", aes_mode=None):
+        if aes_mode is not None and aes_mode.upper() != "ECB":
+            raise ValueError(f"Points of interest can only be found in ECB mode, not {aes_mode}")
+        path = self.cache_path(backend, sbox_name, platform, aes_mode)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return np.asarray(json.load(f)["pois"], dtype=np.int64)
+
+        textin_array, trace_array = backend.capture(self.profile_traces)
+        scores = POI_METHODS[self.method](textin_array, trace_array)
+        pois = select_pois(scores, self.k, self.window)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"pois": pois.tolist(), "samples": int(np.shape(trace_array)[1]),
+                       "sbox_name": sbox_name, "platform": platform, "aes_mode": aes_mode}, f)
+        os.replace(path + ".tmp", path)
+        return pois
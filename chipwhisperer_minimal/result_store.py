@@ -0,0 +1,164 @@
+import os
+import re
+import sqlite3
+
+# Result store. Results live in one SQLite database with two tables: `runs` holds the value of every
+# single run, keyed by (sbox_name, device, method, aes_mode, n_traces, run_index), and `results` holds
+# the final metric of every finished unit of work, (sbox_name, device, method, aes_mode). Every row is
+# committed as soon as it is known, so a campaign interrupted by a crash or a USB drop is resumed
+# where it stopped: finished units are skipped and the runs already done are reused.
+#
+# For TVLA a run value is its percentage of leaking samples and n_traces is METRIC_HIGH. For CPA and
+# DPA a run value is 1 if the key was recovered with n_traces traces and 0 if not.
+
+DEFAULT_PATH = "./results/results.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    sbox_name TEXT NOT NULL,
+    device TEXT NOT NULL,
+    method TEXT NOT NULL,
+    aes_mode TEXT NOT NULL,
+    n_traces INTEGER NOT NULL,
+    run_index INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (sbox_name, device, method, aes_mode, n_traces, run_index)
+);
+CREATE TABLE IF NOT EXISTS results (
+    sbox_name TEXT NOT NULL,
+    device TEXT NOT NULL,
+    method TEXT NOT NULL,
+    aes_mode TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (sbox_name, device, method, aes_mode)
+);
+"""
+
+# Key of a unit of work. CPA and DPA do not depend on the AES mode in main.py, they are stored as ECB.
+def unit_key(sbox_name, device, method, aes_mode=None):
+    return (sbox_name, device.upper(), method.upper(), (aes_mode or "ECB").upper())
+
+
+class ResultStore:
+    """Durable store of run values and final results. Several processes can share one database, e.g.
+    the workers of a campaign."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        # Readers do not block the writers of other processes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def record_run(self, unit, n_traces, run_index, value):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*unit_key(*unit), int(n_traces), int(run_index), float(value)),
+            )
+
+    def record_result(self, unit, value):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (*unit_key(*unit), float(value))
+            )
+
+    # {run_index: value} of the runs of a unit done with n_traces traces
+    def runs(self, unit, n_traces):
+        rows = self.connection.execute(
+            "SELECT run_index, value FROM runs WHERE sbox_name=? AND device=? AND method=? AND aes_mode=? AND n_traces=?",
+            (*unit_key(*unit), int(n_traces)),
+        )
+        return dict(rows.fetchall())
+
+    # Final result of a unit, None if it is not finished
+    def result(self, unit):
+        row = self.connection.execute(
+            "SELECT value FROM results WHERE sbox_name=? AND device=? AND method=? AND aes_mode=?", unit_key(*unit)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def completed_units(self):
+        return set(self.connection.execute("SELECT sbox_name, device, method, aes_mode FROM results").fetchall())
+
+    def load_results(self):
+        """All final results, one row per unit"""
+        import pandas as pd
+        return pd.read_sql_query("SELECT * FROM results", self.connection)
+
+    def load_runs(self):
+        """All run values, one row per run"""
+        import pandas as pd
+        return pd.read_sql_query("SELECT * FROM runs", self.connection)
+
+    def close(self):
+        self.connection.close()
+
+
+# Reads the text files main.py used to write, e.g. n_traces_cwnano_CPA.txt or avg_leaks_cwnano_ECB.txt,
+# into the results table. As in import_results.ipynb, the TVLA values of those files are doubled to
+# make up for the old tvla that halved its results.
+def import_text_results(store, directory="./results", leaks_scale=2):
+    patterns = [
+        (r"^n_traces_(cwnano|cwlitearm)_(cpa|dpa)\.txt$", lambda m: (m[1], m[2], "ECB")),
+        (r"^n_traces_(cpa|dpa)_(cwnano|cwlitearm)\.txt$", lambda m: (m[2], m[1], "ECB")),
+        (r"^avg_leaks_(cwnano|cwlitearm)_(ecb|cbc|ctr)\.txt$", lambda m: (m[1], "TVLA", m[2])),
+    ]
+    imported = 0
+    for filename in sorted(os.listdir(directory)):
+        for pattern, fields in patterns:
+            match = re.match(pattern, filename, re.IGNORECASE)
+            if match:
+                break
+        else:
+            continue
+        device, method, aes_mode = fields(match)
+        scale = leaks_scale if method.upper() == "TVLA" else 1
+        with open(os.path.join(directory, filename), "r") as f:
+            for line in f:
+                values = line.split()
+                if len(values) == 2:
+                    store.record_result((values[0], device, method, aes_mode), scale * float(values[1]))
+                    imported += 1
+    return imported
+
+
+# One row per sbox and one column per (device, method, aes_mode), named as in sboxes_results.csv:
+# cwnano_CPA_n_traces, cwnano_ECB_avg_leaks, ... If sboxes_df is given, the sbox metrics are joined in.
+def results_table(store, sboxes_df=None):
+    results = store.load_results()
+    is_tvla = results["method"] == "TVLA"
+    results["column"] = (
+        results["device"].str.lower() + "_"
+        + results["aes_mode"].where(is_tvla, results["method"]) + "_"
+        + is_tvla.map({True: "avg_leaks", False: "n_traces"})
+    )
+    table = results.pivot(index="sbox_name", columns="column", values="value")
+    table.columns.name = None
+    if sboxes_df is not None:
+        info = sboxes_df.drop(columns=["box", "inverse"], errors="ignore")
+        table = info.join(table)
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+    from chipwhisperer_minimal.sbox_catalog import CATALOG_DIR, load_catalog
+
+    parser = argparse.ArgumentParser(description="Import the old text results or export the results as a CSV table")
+    parser.add_argument("--db", default=DEFAULT_PATH)
+    parser.add_argument("--import-text", metavar="DIR", help="import the n_traces_*.txt and avg_leaks_*.txt files of DIR")
+    parser.add_argument("--csv", metavar="FILE", help="write the results, joined with the sbox info, to FILE")
+    parser.add_argument("--sboxes", default=CATALOG_DIR, help="directory of the sbox catalog")
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    if args.import_text:
+        print(f"Imported {import_text_results(store, args.import_text)} results")
+    if args.csv:
+        sboxes_df = load_catalog(args.sboxes).to_dataframe()
+        results_table(store, sboxes_df).round(5).to_csv(args.csv)
+    store.close()
@@ -0,0 +1,123 @@
+import json
+import os
+from collections.abc import Mapping
+import numpy as np
+
+# The catalog of s-boxes and their metrics, as written by sboxes_info.py. It is a directory of plain
+# arrays that are memory mapped when loaded, so opening it costs a few milliseconds whatever its size:
+#
+#   boxes.npy     (N, 256) uint8, the s-boxes
+#   inverses.npy  (N, 256) uint8, their inverses, zero for the s-boxes that are not permutations
+#   metrics.npy   (N,) structured array of the metrics of sboxes_info.create_row
+#   names.json    the N names, in catalog order
+#
+# A loaded catalog is a read only mapping of name -> row, the row being the dict create_row gives, so
+# it can be used wherever the dict of the old sboxes_info.pkl DataFrame was.
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CATALOG_DIR = f"{current_dir}/generate_c/sbox_catalog"
+
+METRICS_DTYPE = np.dtype([
+    ("permutation", np.bool_),
+    ("nonlinearity", np.int64),
+    ("linear_probability", np.float64),
+    ("differential_probability", np.float64),
+    ("boomerang_uniformity", np.int64),
+    ("diff_branch", np.int64),
+    ("linear_branch", np.int64),
+    ("linearity", np.int64),
+    ("bic", np.float64),
+    ("sac", np.float64),
+])
+# The metrics of a row, in the order of create_row
+METRIC_NAMES = list(METRICS_DTYPE.names[1:])
+
+class SboxCatalog(Mapping):
+    """Memory mapped s-box catalog, see the top of the file"""
+
+    def __init__(self, directory=CATALOG_DIR):
+        self.directory = directory
+        with open(f"{directory}/names.json", "r") as f:
+            self.names = json.load(f)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.boxes = np.load(f"{directory}/boxes.npy", mmap_mode="r")
+        self.inverses = np.load(f"{directory}/inverses.npy", mmap_mode="r")
+        self.metrics = np.load(f"{directory}/metrics.npy", mmap_mode="r")
+
+    # Sent to other processes as its directory, not as its arrays
+    def __reduce__(self):
+        return (SboxCatalog, (self.directory,))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        i = self.index[name]
+        metrics = self.metrics[i]
+        row = {
+            "box": self.boxes[i].tolist(),
+            "inverse": self.inverses[i].tolist() if metrics["permutation"] else [],
+        }
+        row.update({metric: metrics[metric].item() for metric in METRIC_NAMES})
+        return row
+
+    def box(self, name):
+        """(256,) uint8 view of the s-box"""
+        return self.boxes[self.index[name]]
+
+    def inverse(self, name):
+        """(256,) uint8 view of the inverse of the s-box, None if it is not a permutation"""
+        i = self.index[name]
+        return self.inverses[i] if self.metrics[i]["permutation"] else None
+
+    def to_dataframe(self):
+        """The catalog as the DataFrame of the old sboxes_info.pkl, indexed by name"""
+        import pandas as pd
+        return pd.DataFrame.from_dict({name: self[name] for name in self.names}, orient="index")
+
+def write_catalog(rows, directory=CATALOG_DIR):
+    """Writes a dict of name -> create_row row as a catalog. names.json is written last, so a catalog
+    is never read while half written."""
+    names = list(rows.keys())
+    boxes = np.zeros((len(names), 256), dtype=np.uint8)
+    inverses = np.zeros((len(names), 256), dtype=np.uint8)
+    metrics = np.zeros(len(names), dtype=METRICS_DTYPE)
+    for i, name in enumerate(names):
+        row = rows[name]
+        if len(row["box"]) != 256:
+            raise ValueError(f"{name} is not an 8-bit s-box")
+        boxes[i] = row["box"]
+        metrics[i]["permutation"] = len(row["inverse"]) > 0
+        if len(row["inverse"]):
+            inverses[i] = row["inverse"]
+        for metric in METRIC_NAMES:
+            metrics[i][metric] = row[metric]
+
+    os.makedirs(directory, exist_ok=True)
+    for filename, array in [("boxes.npy", boxes), ("inverses.npy", inverses), ("metrics.npy", metrics)]:
+        np.save(f"{directory}/{filename}.tmp.npy", array)
+        os.replace(f"{directory}/{filename}.tmp.npy", f"{directory}/{filename}")
+    with open(f"{directory}/names.json.tmp", "w") as f:
+        json.dump(names, f)
+    os.replace(f"{directory}/names.json.tmp", f"{directory}/names.json")
+    _loaded.pop(directory, None)
+
+# Open catalogs, by directory, along with the names.json modification time they were opened at
+_loaded = {}
+
+def load_catalog(directory=CATALOG_DIR):
+    """The catalog of the directory, opened once and reused until it is written again. Raises
+    FileNotFoundError if there is no catalog, see sboxes_info.py."""
+    mtime = os.stat(f"{directory}/names.json").st_mtime_ns
+    if directory not in _loaded or _loaded[directory][0] != mtime:
+        _loaded[directory] = (mtime, SboxCatalog(directory))
+    return _loaded[directory][1]
+
+def catalog_exists(directory=CATALOG_DIR):
+    return os.path.exists(f"{directory}/names.json")
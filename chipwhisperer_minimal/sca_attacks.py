@@ -1,6 +1,6 @@
 import numpy as np
-from tqdm import trange
-from scipy.stats import ttest_ind
+from chipwhisperer_minimal.leakage_models import leakage_table, selection_table
+from chipwhisperer_minimal.poi import snr, select_pois
 
 HW = [bin(n).count("1") for n in range(0,256)]
 
@@ -30,59 +30,167 @@ def calculate_diffs(sbox, textin_array, trace_array, guess, byteindex=0, bitnum=
     return abs(one_avg - zero_avg)
 
 
-def dpa_run(sbox, textin_array, trace_array):
+def dpa_engine(sbox, textin_array, trace_array, bitnum=0, byteindices=range(16), dtype=np.float64, model=None):
+    """Batched DPA: the selection bit of all 256 guesses is computed as one boolean matrix and the
+    group sums come from a single matrix product. Returns the key guess and the peak
+    difference of means for each byte in byteindices. The selection is bit `bitnum` of the s-box
+    output, or any 0/1 leakage model given by name. Raises ValueError for a model with other
+    values."""
+    model = model or f"bit{bitnum}"
+    selection_table(sbox, model)
+    textins = np.asarray(textin_array, dtype=np.uint8)
+    traces = np.asarray(trace_array, dtype=dtype)
+    total_sum = traces.sum(axis=0)
+    numtraces = traces.shape[0]
+
     key_guess = []
-    # known_key = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
-
-    # full_diffs_list = []
-    for subkey in trange(0, 16, desc="Attacking Subkey", leave=False):
-        max_diffs = [0]*256
-        full_diffs = [0]*256
-        for guess in range(0, 256):
-            full_diff_trace = calculate_diffs(sbox, textin_array, trace_array, guess, subkey)
-            max_diffs[guess] = np.max(full_diff_trace)
-            full_diffs[guess] = full_diff_trace
-            
+    peak_diffs = []
+    for subkey in byteindices:
+        selection = hypothesis_matrix(sbox, textins, subkey, model)
+
+        # (256, samples) sums of the traces whose selection bit is set
+        one_sum = selection.T.astype(dtype) @ traces
+        one_count = selection.sum(axis=0, dtype=np.int64)[:, None]
+        zero_count = numtraces - one_count
+
+        # An empty group gives a nan mean, exactly as calculate_diffs does
+        with np.errstate(divide="ignore", invalid="ignore"):
+            full_diffs = np.abs(one_sum / one_count - (total_sum - one_sum) / zero_count)
+        max_diffs = np.max(full_diffs, axis=1)
+
         #Get argument sort, as each index is the actual key guess.
-        # full_diffs_list.append(full_diffs[:])
         sorted_args = np.argsort(max_diffs)[::-1]
-        
-        #Keep most likely
         key_guess.append(sorted_args[0])
+        peak_diffs.append(max_diffs[sorted_args[0]])
+    return key_guess, np.asarray(peak_diffs)
+
+def dpa_run(sbox, textin_array, trace_array, bitnum=0, dtype=np.float64, model=None):
+    key_guess, _ = dpa_engine(sbox, textin_array, trace_array, bitnum, dtype=dtype, model=model)
     return key_guess
-    
-def cpa_run(sbox, textin_array, trace_array):
-    # Dr. O'Flynn's CPA stat functions
-    def mean(X):
-        return np.sum(X, axis=0)/len(X)
-    def std_dev(X, X_bar):
-        return np.sqrt(np.sum((X-X_bar)**2, axis=0))
-    def cov(X, X_bar, Y, Y_bar):
-        return np.sum((X-X_bar)*(Y-Y_bar), axis=0)
 
+# Builds the (N, 256) uint8 matrix of hypothetical leakages of one key byte, one column per key
+# guess, from the cached table of the leakage model. The default model is the intermediate
+# sbox[p ^ k] itself.
+def hypothesis_matrix(sbox, textins, byteindex, model="identity", sboxcomp=None):
+    return leakage_table(sbox, model, sboxcomp)[textins[:, byteindex]]
 
-    t_bar = mean(trace_array) 
-    o_t = std_dev(trace_array, t_bar)
+def cpa_engine(sbox, textin_array, trace_array, dtype=np.float64, model="hw"):
+    """Vectorized CPA: every key guess of a byte is correlated against every sample with a single
+    matrix product. Returns the key guess and the peak absolute correlation for each byte. The
+    hypotheses come from the named leakage model, the Hamming weight of the s-box output by
+    default."""
+    textins = np.asarray(textin_array, dtype=np.uint8)
+    traces = np.asarray(trace_array, dtype=dtype)
+
+    # Center the traces once, they are shared by all bytes and guesses
+    t_centered = traces - traces.mean(axis=0)
+    o_t = np.sqrt(np.sum(t_centered**2, axis=0))
 
-    # cparefs = [0] * 16
     key_guess = [0] * 16
-    for bnum in trange(0, 16, desc="Attacking subkey", leave=False):
-        maxcpa = [0] * 256
-        for kguess in range(0, 256):
-            hws = np.array([[HW[aes_internal(sbox, textin[bnum], kguess)] for textin in textin_array]]).transpose()
-            hws_bar = mean(hws)
-            o_hws = std_dev(hws, hws_bar)
-            covariance = cov(trace_array, t_bar, hws, hws_bar)
-            correlation = covariance/(o_t*o_hws)
-            maxcpa[kguess] = max(abs(correlation))
-        # cparefs[bnum] = max(maxcpa)
+    peak_corrs = np.zeros(16, dtype=dtype)
+    for bnum in range(0, 16):
+        hws = hypothesis_matrix(sbox, textins, bnum, model).astype(dtype)
+        h_centered = hws - hws.mean(axis=0)
+        o_hws = np.sqrt(np.sum(h_centered**2, axis=0))
+
+        # (256, samples) correlation matrix
+        covariance = h_centered.T @ t_centered
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = covariance / np.outer(o_hws, o_t)
+        maxcpa = np.nan_to_num(np.abs(correlation)).max(axis=1)
+
         key_guess[bnum] = np.argmax(maxcpa)
+        peak_corrs[bnum] = maxcpa[key_guess[bnum]]
+    return key_guess, peak_corrs
+
+def cpa_run(sbox, textin_array, trace_array, dtype=np.float64, model="hw"):
+    # Dr. O'Flynn's CPA, computed for all guesses at once by cpa_engine
+    key_guess, _ = cpa_engine(sbox, textin_array, trace_array, dtype, model)
     return key_guess
 
 
+class TemplateAttack:
+    """Profiled attack with Gaussian templates and a pooled covariance.
+
+    profile() builds, for every key byte, one template per class of the leakage model (the 256
+    values of sbox[p ^ k] by default) from traces of a device with a known key: the class means over
+    the points of interest of the byte, and one covariance matrix pooled over all classes. The
+    attack then scores all 256 guesses of a byte at once, summing the log-likelihood of every trace
+    under the class the guess predicts for it.
+
+    A profiled TemplateAttack is used as an attack_function, see template_metrics in metrics.py.
+    Profiled on the device and key it then attacks, it gives an upper bound on the strength of the
+    attack."""
+
+    def __init__(self, pois=5, model="identity", batch_size=10000):
+        self.pois = pois
+        self.model = model
+        self.batch_size = batch_size
+        self.byte_pois = None
+
+    def profile(self, sbox, textin_array, trace_array, key):
+        """Builds the templates of the 16 bytes from profiling traces captured with the given key.
+        The points of interest of a byte are its `pois` samples of highest SNR."""
+        textins = np.asarray(textin_array, dtype=np.uint8)
+        traces = np.asarray(trace_array, dtype=np.float64)
+        table = leakage_table(sbox, self.model)
+        classes = int(table.max()) + 1
+
+        self.byte_pois, self.whitening, self.templates, self.offsets = [], [], [], []
+        for bnum, scores in enumerate(snr(textins, traces)):
+            pois = select_pois(scores, self.pois)
+            points = traces[:, pois]
+            labels = table[textins[:, bnum], key[bnum]]
+
+            # Class means, classes without a profiling trace getting the overall mean
+            counts = np.bincount(labels, minlength=classes)
+            sums = np.stack([np.bincount(labels, weights=points[:, j], minlength=classes) for j in range(len(pois))], axis=1)
+            means = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], points.mean(axis=0))
+
+            residuals = points - means[labels]
+            covariance = residuals.T @ residuals / max(len(points) - np.count_nonzero(counts), 1)
+            # A little ridge keeps the covariance invertible when a point never varies
+            covariance += np.eye(len(pois)) * (1e-9 * np.trace(covariance) / len(pois) + 1e-12)
+
+            # With the whitening W = inv(L).T of the Cholesky factor L, the log-likelihood of a trace
+            # x under a class of mean m is, up to terms that do not depend on the class,
+            # (xW).(mW) - |mW|^2 / 2
+            whitening = np.linalg.inv(np.linalg.cholesky(covariance)).T
+            templates = means @ whitening
+            self.byte_pois.append(pois)
+            self.whitening.append(whitening)
+            self.templates.append(templates)
+            self.offsets.append(-0.5 * np.sum(templates**2, axis=1))
+        return self
+
+    def engine(self, sbox, textin_array, trace_array):
+        """Key guess and (16, 256) summed log-likelihoods of every guess of every byte"""
+        if self.byte_pois is None:
+            raise RuntimeError("TemplateAttack used before profile()")
+        textins = np.asarray(textin_array, dtype=np.uint8)
+        table = leakage_table(sbox, self.model)
+
+        log_likelihoods = np.zeros((16, 256))
+        for start in range(0, len(textins), self.batch_size):
+            batch = np.asarray(trace_array[start:start + self.batch_size], dtype=np.float64)
+            for bnum in range(16):
+                whitened = batch[:, self.byte_pois[bnum]] @ self.whitening[bnum]
+                # (N, classes) log-likelihood of every trace under every class
+                class_scores = whitened @ self.templates[bnum].T + self.offsets[bnum]
+                # (N, 256) class predicted by every guess
+                predicted = table[textins[start:start + self.batch_size, bnum]]
+                log_likelihoods[bnum] += np.take_along_axis(class_scores, predicted.astype(np.intp), axis=1).sum(axis=0)
+        return list(np.argmax(log_likelihoods, axis=1)), log_likelihoods
+
+    def __call__(self, sbox, textin_array, trace_array):
+        key_guess, _ = self.engine(sbox, textin_array, trace_array)
+        return key_guess
+
 
 # Returns the percentage of traces that are broken (detected leakage)
 def tvla_run(fixed_traces, random_traces, threshold):
+    # scipy is slow to import, and only TVLA needs it
+    from scipy.stats import ttest_ind
 
     trace_len = len(fixed_traces[0])
     group1_len = len(fixed_traces) // 2
@@ -91,11 +199,9 @@ def tvla_run(fixed_traces, random_traces, threshold):
     t[0] = ttest_ind(fixed_traces[:group1_len], random_traces[:group2_len], axis=0, equal_var=False)[0]
     t[1] = ttest_ind(fixed_traces[group1_len:], random_traces[group2_len:], axis=0, equal_var=False)[0]
 
-    num_leaks = 0
-    for i in range(len(t[0])):
-        if abs(t[0][i]) >= threshold and abs(t[1][i]) >= threshold:
-            num_leaks+=1
-
-    percentage_breaks = num_leaks/len(t[0])
+    return count_leaks(t, threshold)
 
-    return percentage_breaks
\ No newline at end of file
+# Fraction of samples where both t-tests exceed the threshold
+def count_leaks(t, threshold):
+    num_leaks = np.count_nonzero(np.all(np.abs(t) >= threshold, axis=0))
+    return num_leaks/t.shape[1]
\ No newline at end of file
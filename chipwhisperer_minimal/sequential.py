@@ -0,0 +1,73 @@
+import math
+
+# Early stopping for the success rate decision of num_traces. At every midpoint num_traces decides
+# whether the attack succeeds at least `threshold` of the time over total_runs runs. A stopping rule
+# looks at the runs done so far and stops as soon as the decision is settled, so the remaining runs
+# are not captured.
+
+class StoppingRule:
+    """Base of the stopping rules. decide() returns True (success rate reached), False (not reached)
+    or None (keep going). num_traces keeps every decision in `history` as (n_traces, successes, runs,
+    total_runs, decision), to see how many runs it took."""
+
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self.history = []
+
+    def decide(self, successes, runs, total_runs):
+        raise NotImplementedError
+
+    # Decision of num_traces once all total_runs runs are done
+    def final(self, successes, total_runs):
+        return successes >= self.threshold * total_runs
+
+    def record(self, n_traces, successes, runs, total_runs, decision):
+        self.history.append((n_traces, successes, runs, total_runs, decision))
+
+    def summary(self):
+        """Runs used over every decision, against the runs of the fixed rule"""
+        return {
+            "decisions": len(self.history),
+            "runs_used": sum(entry[2] for entry in self.history),
+            "runs_budget": sum(entry[3] for entry in self.history),
+        }
+
+
+class Curtailment(StoppingRule):
+    """Stops once the remaining runs can no longer change the decision: enough successes to reach the
+    threshold, or too many failures to reach it. The decisions, and so the thresholds found, are
+    exactly those of running all the runs."""
+
+    def decide(self, successes, runs, total_runs):
+        if self.final(successes, total_runs):
+            return True
+        if not self.final(successes + total_runs - runs, total_runs):
+            return False
+        return None
+
+
+class SPRT(Curtailment):
+    """Wald's sequential probability ratio test of a success rate of at least p1 against one of at
+    most p0, with error rates alpha (deciding success when the rate is p0) and beta (deciding failure
+    when it is p1). Rates between p0 and p1 may go either way. The test is truncated at total_runs,
+    and curtailed like Curtailment, so it never uses more runs than the fixed rule."""
+
+    def __init__(self, threshold=0.9, p0=0.75, p1=0.97, alpha=0.05, beta=0.05):
+        super().__init__(threshold)
+        if not 0 < p0 < threshold < p1 < 1:
+            raise ValueError(f"Expected 0 < p0 < threshold < p1 < 1, got p0 = {p0}, p1 = {p1}")
+        self.success_step = math.log(p1 / p0)
+        self.failure_step = math.log((1 - p1) / (1 - p0))
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+
+    def decide(self, successes, runs, total_runs):
+        decision = super().decide(successes, runs, total_runs)
+        if decision is not None:
+            return decision
+        llr = successes * self.success_step + (runs - successes) * self.failure_step
+        if llr >= self.upper:
+            return True
+        if llr <= self.lower:
+            return False
+        return None
@@ -0,0 +1,248 @@
+import numpy as np
+from chipwhisperer_minimal.sca_attacks import HW
+from chipwhisperer_minimal.helper_functions import KNOWN_KEY, TVLA_FIXED_TEXT
+from chipwhisperer_minimal.capture import CaptureBackend
+
+# Leakage simulator for the tiny-AES128-C firmware built by generate_c_files. AES-128 is run with any
+# s-box on a whole batch of blocks at once, and the traces are built from the Hamming weight or
+# distance of the chosen intermediates plus Gaussian noise and jitter.
+
+RCON = [0x8d, 0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36]
+# IV the firmware uses in CBC and CTR mode, see aes-independant.c. It is set with the key, and then
+# carried from one encryption to the next.
+FIRMWARE_IV = bytes(range(16))
+# In CBC and CTR mode aes_indep_enc encrypts 64 bytes in place from the 16 byte plaintext, so the 48
+# bytes after it in the serial buffer are encrypted too. They are not known, and taken to be zeros.
+BLOCKS_PER_CALL = 4
+FIRMWARE_TAIL = bytes(16 * (BLOCKS_PER_CALL - 1))
+
+# Intermediates of the first round in the order the firmware computes them. "hd" leakage is the
+# distance from an intermediate to the one before it, which it overwrites in the state.
+INTERMEDIATES = ["input", "add_round_key", "sub_bytes", "shift_rows", "mix_columns"]
+
+# The state is stored column by column, so byte r + 4c is row r of column c
+SHIFT_ROWS = np.array([(r + 4 * ((c + r) % 4)) for c in range(4) for r in range(4)])
+XTIME = np.array([((x << 1) ^ (0x1b if x & 0x80 else 0)) & 0xff for x in range(256)], dtype=np.uint8)
+
+def key_expansion(key, sbox):
+    round_keys = [list(key)]
+    for i in range(1, 11):
+        prev = round_keys[-1]
+        tempa = [sbox[b] for b in prev[13:16] + prev[12:13]]
+        tempa[0] ^= RCON[i]
+        words = []
+        for w in range(4):
+            tempa = [prev[4*w + j] ^ tempa[j] for j in range(4)]
+            words += tempa
+        round_keys.append(words)
+    return np.array(round_keys, dtype=np.uint8)
+
+def mix_columns(state):
+    cols = state.reshape(-1, 4, 4)
+    rotated = np.roll(cols, -1, axis=2)
+    total = cols[:, :, 0] ^ cols[:, :, 1] ^ cols[:, :, 2] ^ cols[:, :, 3]
+    return (cols ^ total[:, :, None] ^ XTIME[cols ^ rotated]).reshape(-1, 16)
+
+# Runs the first `rounds` rounds of AES-128 (all of them by default) on a batch of (N, 16) blocks.
+# Returns the resulting state, and the first round intermediates named in `names`
+def aes_encrypt(blocks, round_keys, sbox, names=(), rounds=10):
+    sbox_table = np.asarray(sbox, dtype=np.uint8)
+    state = np.asarray(blocks, dtype=np.uint8)
+    intermediates = {"input": state}
+
+    state = state ^ round_keys[0]
+    intermediates["add_round_key"] = state
+    for rnd in range(1, rounds + 1):
+        state = sbox_table[state]
+        if rnd == 1:
+            intermediates["sub_bytes"] = state
+        state = state[:, SHIFT_ROWS]
+        if rnd == 1:
+            intermediates["shift_rows"] = state
+        if rnd != 10:
+            state = mix_columns(state)
+            if rnd == 1:
+                intermediates["mix_columns"] = state
+        state = state ^ round_keys[rnd]
+    return state, {name: intermediates[name] for name in names}
+
+# Round tables of encrypt_words: T0[x] is column (2 S[x], S[x], S[x], 3 S[x]) of SubBytes then
+# MixColumns, as a big endian word, and T1 to T3 are it rotated by one to three bytes
+def round_tables(sbox):
+    t0 = [(int(XTIME[s]) << 24) | (s << 16) | (s << 8) | (int(XTIME[s]) ^ s) for s in (int(x) for x in sbox)]
+    return [t0] + [[((w >> 8 * i) | (w << 32 - 8 * i)) & 0xffffffff for w in t0] for i in range(1, 4)]
+
+# Python version of aes_encrypt for a single block of 4 big endian column words, as ints. The CBC
+# chain has to be run one block after the other, where a NumPy call per step costs more than the
+# step itself. Each column of rounds 1 to 9 is four table lookups, with ShiftRows in the choice of
+# the columns the bytes are taken from.
+def encrypt_words(words, round_keys, tables, sbox):
+    t0, t1, t2, t3 = tables
+    k = round_keys[0]
+    a, b, c, d = words[0] ^ k[0], words[1] ^ k[1], words[2] ^ k[2], words[3] ^ k[3]
+    for k in round_keys[1:10]:
+        a, b, c, d = (
+            t0[a >> 24] ^ t1[(b >> 16) & 255] ^ t2[(c >> 8) & 255] ^ t3[d & 255] ^ k[0],
+            t0[b >> 24] ^ t1[(c >> 16) & 255] ^ t2[(d >> 8) & 255] ^ t3[a & 255] ^ k[1],
+            t0[c >> 24] ^ t1[(d >> 16) & 255] ^ t2[(a >> 8) & 255] ^ t3[b & 255] ^ k[2],
+            t0[d >> 24] ^ t1[(a >> 16) & 255] ^ t2[(b >> 8) & 255] ^ t3[c & 255] ^ k[3],
+        )
+    # The last round has no MixColumns
+    k = round_keys[10]
+    return [
+        ((sbox[a >> 24] << 24) | (sbox[(b >> 16) & 255] << 16) | (sbox[(c >> 8) & 255] << 8) | sbox[d & 255]) ^ k[0],
+        ((sbox[b >> 24] << 24) | (sbox[(c >> 16) & 255] << 16) | (sbox[(d >> 8) & 255] << 8) | sbox[a & 255]) ^ k[1],
+        ((sbox[c >> 24] << 24) | (sbox[(d >> 16) & 255] << 16) | (sbox[(a >> 8) & 255] << 8) | sbox[b & 255]) ^ k[2],
+        ((sbox[d >> 24] << 24) | (sbox[(a >> 16) & 255] << 16) | (sbox[(b >> 8) & 255] << 8) | sbox[c & 255]) ^ k[3],
+    ]
+
+# (n, 4) big endian column words of (n, 16) blocks, and back
+def to_words(blocks):
+    return np.ascontiguousarray(blocks, dtype=np.uint8).view(">u4").reshape(-1, 4)
+
+def from_words(words):
+    return np.asarray(words, dtype=">u4").view(np.uint8).reshape(-1, 16)
+
+# (n, 16) big endian 128 bit counter blocks start, start + step, start + 2 step, ...
+def counter_blocks(start, n, step=1):
+    base = int.from_bytes(bytes(start), "big")
+    base_lo = np.uint64(base & (2**64 - 1))
+    lo = base_lo + np.arange(n, dtype=np.uint64) * np.uint64(step)
+    hi = np.uint64(base >> 64) + (lo < base_lo).astype(np.uint64)
+    halves = [half.astype(">u8").view(np.uint8).reshape(-1, 8) for half in (hi, lo)]
+    return np.concatenate(halves, axis=1)
+
+def firmware_blocks(plaintexts, round_keys, sbox, aes_mode="ECB", iv=FIRMWARE_IV, tail=FIRMWARE_TAIL):
+    """First block fed to the cipher by each call of aes_indep_enc, one call per plaintext, and
+    the IV the firmware is left with.
+
+    In CBC and CTR mode the firmware encrypts BLOCKS_PER_CALL blocks per call: the plaintext and
+    the `tail` that follows it in the serial buffer. CBC encrypts the plaintext xor the IV, and the
+    last ciphertext block of the call is the IV of the next one. CTR encrypts the counter, which
+    starts at the IV and moves on by BLOCKS_PER_CALL per call, and the plaintext never enters the
+    cipher."""
+    plaintexts = np.asarray(plaintexts, dtype=np.uint8)
+    if aes_mode is None or aes_mode.upper() == "ECB":
+        return plaintexts, iv
+    n = len(plaintexts)
+    if aes_mode.upper() == "CTR":
+        end = (int.from_bytes(bytes(iv), "big") + BLOCKS_PER_CALL * n) % (1 << 128)
+        return counter_blocks(iv, n, BLOCKS_PER_CALL), end.to_bytes(16, "big")
+    if aes_mode.upper() == "CBC":
+        # Every call starts from the IV the one before it left, so the calls can not be run side by side
+        keys = to_words(round_keys).tolist()
+        table = [int(b) for b in sbox]
+        tables = round_tables(table)
+        tail_blocks = to_words(np.frombuffer(bytes(tail), dtype=np.uint8)).tolist()
+        blocks = []
+        chain = to_words(np.frombuffer(bytes(iv), dtype=np.uint8))[0].tolist()
+        for plaintext in to_words(plaintexts).tolist():
+            block = [p ^ c for p, c in zip(plaintext, chain)]
+            blocks.append(block)
+            chain = encrypt_words(block, keys, tables, table)
+            for tail_block in tail_blocks:
+                chain = encrypt_words([t ^ c for t, c in zip(tail_block, chain)], keys, tables, table)
+        return from_words(blocks), from_words([chain]).tobytes()
+    raise ValueError(f"Unknown AES mode: {aes_mode}")
+
+
+class LeakageSimulator:
+    """Builds synthetic traces for one s-box and key.
+
+    `leakage` lists the (intermediate, model) pairs that leak, model being "hw" or "hd". Every
+    leaking byte gets its own sample, `spacing` samples apart starting at `offset`, on top of a
+    fixed random baseline. Each trace is then shifted by up to `jitter` samples and gets Gaussian
+    noise of standard deviation `noise`."""
+
+    def __init__(self, sbox, key=KNOWN_KEY, aes_mode="ECB", leakage=(("sub_bytes", "hw"),),
+                 samples=200, offset=10, spacing=2, amplitude=1.0, noise=1.0, jitter=0, seed=None):
+        self.sbox = sbox
+        self.key = list(key)
+        self.round_keys = key_expansion(self.key, sbox)
+        self.aes_mode = aes_mode
+        self.leakage = list(leakage)
+        self.samples = samples
+        self.amplitude = amplitude
+        self.noise = noise
+        self.jitter = jitter
+        self.rng = np.random.default_rng(seed)
+        self.iv = FIRMWARE_IV
+
+        self.points = offset + spacing * np.arange(16 * len(self.leakage))
+        if self.points[-1] + jitter >= samples:
+            raise ValueError(f"{len(self.points)} leaking points do not fit in {samples} samples")
+        self.baseline = self.rng.normal(0, amplitude, samples).astype(np.float32)
+        self.hw_table = np.asarray(HW, dtype=np.float32) * np.float32(amplitude)
+
+    # Leakage of every leaking byte, (N, 16 * len(leakage))
+    def leakage_values(self, blocks):
+        names = set()
+        for name, model in self.leakage:
+            names.add(name)
+            if model == "hd":
+                names.add(INTERMEDIATES[INTERMEDIATES.index(name) - 1])
+        # Everything that leaks is computed by the first round
+        _, intermediates = aes_encrypt(blocks, self.round_keys, self.sbox, sorted(names), rounds=1)
+
+        values = []
+        for name, model in self.leakage:
+            if model == "hw":
+                values.append(intermediates[name])
+            elif model == "hd":
+                values.append(intermediates[name] ^ intermediates[INTERMEDIATES[INTERMEDIATES.index(name) - 1]])
+            else:
+                raise ValueError(f"Unknown leakage model: {model}")
+        return self.hw_table[np.concatenate(values, axis=1)]
+
+    def traces(self, plaintexts):
+        """Simulated traces of encrypting each of the plaintexts once, in order. In CBC and CTR
+        mode the IV carries on from the previous call, as in the firmware."""
+        plaintexts = np.asarray(plaintexts, dtype=np.uint8)
+        n = len(plaintexts)
+        blocks, self.iv = firmware_blocks(plaintexts, self.round_keys, self.sbox, self.aes_mode, self.iv)
+
+        # Built in place, the noise is most of the cost for long traces
+        traces = self.rng.standard_normal((n, self.samples), dtype=np.float32)
+        traces *= np.float32(self.noise)
+        if self.jitter:
+            # The noise does not move with the shift, so the signal is shifted before it is added
+            signal = np.empty((n, self.samples), dtype=np.float32)
+            signal[:] = self.baseline
+            signal[:, self.points] += self.leakage_values(blocks)
+            shifts = self.rng.integers(0, self.jitter + 1, n)
+            index = np.arange(self.samples)[None, :] - shifts[:, None]
+            traces += np.take_along_axis(signal, np.maximum(index, 0), axis=1)
+        else:
+            traces += self.baseline
+            traces[:, self.points] += self.leakage_values(blocks)
+        return traces
+
+class SimulatorBackend(CaptureBackend):
+    """Capture backend that simulates the firmware instead of capturing from it.
+
+    `sboxes` maps sbox names to their rows, as in main.py, and the other arguments are passed to
+    LeakageSimulator."""
+
+    def __init__(self, sboxes, seed=None, **simulator_args):
+        self.sboxes = sboxes
+        self.simulator_args = simulator_args
+        self.rng = np.random.default_rng(seed)
+        self.simulator = None
+
+    def prepare(self, sbox_name, platform="CWNANO", aes_mode=None):
+        sbox = self.sboxes[sbox_name]
+        if isinstance(sbox, dict):
+            sbox = sbox["box"]
+        self.simulator = LeakageSimulator(sbox, self.key, aes_mode, seed=self.rng.integers(2**32), **self.simulator_args)
+
+    def capture(self, N):
+        textins = self.rng.integers(0, 256, (N, 16), dtype=np.uint8)
+        return textins, self.simulator.traces(textins)
+
+    # Every trace is from the fixed group with probability one half, as with cw.ktp.TVLATTest
+    def capture_tvla(self, N):
+        textins = self.rng.integers(0, 256, (2 * N, 16), dtype=np.uint8)
+        fixed = self.rng.random(2 * N) < 0.5
+        textins[fixed] = np.frombuffer(bytes(TVLA_FIXED_TEXT), dtype=np.uint8)
+        traces = self.simulator.traces(textins)
+        return traces[fixed], traces[~fixed]
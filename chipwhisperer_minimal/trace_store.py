@@ -0,0 +1,242 @@
+import json
+import os
+import numpy as np
+from chipwhisperer_minimal.capture import CaptureBackend
+from chipwhisperer_minimal.helper_functions import TVLA_FIXED_TEXT
+
+# On-disk trace store. A store is a directory with one raw, fixed-dtype file per column (traces, textins
+# and keys) and a manifest holding the number of committed rows and the metadata. Rows are appended
+# in chunks: the data is written and synced first, and only then is the row count in the manifest
+# replaced atomically, so an interrupted append loses at most the chunk being written.
+
+MANIFEST = "manifest.json"
+# The two groups of a TVLA capture, each kept in a store of its own
+TVLA_GROUPS = ["fixed", "random"]
+
+class TraceStore:
+    """Append-only store of (textin, key, trace) rows, read back as memory-mapped arrays"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), "r") as f:
+            self.manifest = json.load(f)
+        self.columns = {
+            "traces": (np.dtype(self.manifest["trace_dtype"]), (self.manifest["samples"],)),
+            "textins": (np.dtype(np.uint8), (16,)),
+            "keys": (np.dtype(np.uint8), (16,)),
+        }
+
+    @classmethod
+    def create(cls, directory, samples, trace_dtype=np.float64, **metadata):
+        """Creates an empty store. metadata is any JSON-serializable info, e.g. sbox_name, device and
+        aes_mode."""
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, MANIFEST)):
+            raise FileExistsError(f"A trace store already exists in {directory}")
+        manifest = {
+            "count": 0,
+            "samples": int(samples),
+            "trace_dtype": np.dtype(trace_dtype).str,
+            "metadata": metadata,
+        }
+        for column in ["traces", "textins", "keys"]:
+            open(os.path.join(directory, f"{column}.bin"), "wb").close()
+        _write_manifest(directory, manifest)
+        return cls(directory)
+
+    @classmethod
+    def open_or_create(cls, directory, samples, trace_dtype=np.float64, **metadata):
+        """Opens the store, or creates it if there is none. Raises ValueError if the store holds
+        traces of another length or dtype, or different metadata, so that different captures are
+        never mixed in one store."""
+        if not os.path.exists(os.path.join(directory, MANIFEST)):
+            return cls.create(directory, samples, trace_dtype, **metadata)
+        store = cls(directory)
+        expected = {"samples": int(samples), "trace_dtype": np.dtype(trace_dtype).str}
+        found = {"samples": store.manifest["samples"], "trace_dtype": store.manifest["trace_dtype"]}
+        # Compared through JSON, as the metadata was stored
+        expected.update(json.loads(json.dumps(metadata)))
+        found.update({name: store.metadata.get(name) for name in metadata})
+        if found != expected:
+            mismatched = sorted(name for name in expected if found[name] != expected[name])
+            raise ValueError(f"The trace store in {directory} does not match: "
+                             + ", ".join(f"{name} is {found[name]!r}, not {expected[name]!r}" for name in mismatched))
+        return store
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    @property
+    def metadata(self):
+        return self.manifest["metadata"]
+
+    def append(self, textins, traces, keys):
+        """Appends a chunk of rows. keys may also be a single key, shared by every row."""
+        traces = np.asarray(traces, dtype=self.columns["traces"][0])
+        n = traces.shape[0]
+        data = {
+            "traces": traces,
+            "textins": np.asarray(textins, dtype=np.uint8),
+            "keys": np.broadcast_to(np.asarray(keys, dtype=np.uint8), (n, 16)),
+        }
+        count = self.manifest["count"]
+        for column, (dtype, shape) in self.columns.items():
+            if data[column].shape != (n,) + shape:
+                raise ValueError(f"Expected {column} of shape {(n,) + shape}, got {data[column].shape}")
+            row_size = dtype.itemsize * int(np.prod(shape))
+            with open(os.path.join(self.directory, f"{column}.bin"), "r+b") as f:
+                # Anything past the committed rows is left over from an interrupted append
+                f.truncate(count * row_size)
+                f.seek(count * row_size)
+                f.write(np.ascontiguousarray(data[column]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        manifest = dict(self.manifest, count=count + n)
+        _write_manifest(self.directory, manifest)
+        self.manifest = manifest
+
+    def _column(self, column):
+        dtype, shape = self.columns[column]
+        if len(self) == 0:
+            return np.empty((0,) + shape, dtype=dtype)
+        return np.memmap(os.path.join(self.directory, f"{column}.bin"), dtype=dtype, mode="r", shape=(len(self),) + shape)
+
+    # Zero-copy views of the committed rows. Slicing them only reads the rows needed.
+    @property
+    def traces(self):
+        return self._column("traces")
+
+    @property
+    def textins(self):
+        return self._column("textins")
+
+    @property
+    def keys(self):
+        return self._column("keys")
+
+
+# Directory of the store of one sbox, device and AES mode under root. ECB is the firmware default.
+def store_directory(root, sbox_name, platform="CWNANO", aes_mode=None):
+    return os.path.join(root, sbox_name, platform, (aes_mode or "ECB").upper())
+
+# Directory of the store of one group of the TVLA captures of an sbox, device and AES mode under root
+def tvla_directory(root, sbox_name, platform="CWNANO", aes_mode=None, group="fixed"):
+    return os.path.join(store_directory(root, sbox_name, platform, aes_mode), "tvla", group)
+
+def _open_if_exists(directory):
+    return TraceStore(directory) if os.path.exists(os.path.join(directory, MANIFEST)) else None
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class TraceStoreBackend(CaptureBackend):
+    """Capture backend that reads the traces of an sbox, in order, from its store for the device and
+    AES mode under root, see store_directory, and the TVLA groups from their stores, see
+    tvla_directory. With loop, reading a store starts over once it is exhausted."""
+
+    def __init__(self, root, loop=True):
+        self.root = root
+        self.loop = loop
+        self.store = None
+        self.tvla_stores = []
+
+    def prepare(self, sbox_name, platform="CWNANO", aes_mode=None):
+        self.store = _open_if_exists(store_directory(self.root, sbox_name, platform, aes_mode))
+        self.tvla_stores = [_open_if_exists(tvla_directory(self.root, sbox_name, platform, aes_mode, group)) for group in TVLA_GROUPS]
+        stores = [store for store in [self.store] + self.tvla_stores if store is not None and len(store) > 0]
+        if not stores:
+            raise EOFError(f"No stored traces of {sbox_name} on {platform} in {aes_mode or 'ECB'} mode")
+        self.position = 0
+        self.tvla_positions = [0] * len(TVLA_GROUPS)
+        self.key = list(stores[0].keys[0])
+
+    # N rows of the store from position, and the position after them
+    def _read(self, store, position, N):
+        if store is None or len(store) == 0:
+            raise EOFError(f"No stored traces in {self.root} for this capture")
+        textins, traces = [], []
+        while True:
+            stop = min(position + N, len(store))
+            textins.append(store.textins[position:stop])
+            traces.append(store.traces[position:stop])
+            N -= stop - position
+            position = stop
+            if N == 0 or not self.loop:
+                break
+            position = 0
+        if len(traces) == 1:
+            return textins[0], traces[0], position
+        return np.concatenate(textins), np.concatenate(traces), position
+
+    def capture(self, N):
+        textins, traces, self.position = self._read(self.store, self.position, N)
+        return textins, traces
+
+    # N traces of each group
+    def capture_tvla(self, N):
+        groups = []
+        for i, store in enumerate(self.tvla_stores):
+            _, traces, self.tvla_positions[i] = self._read(store, self.tvla_positions[i], N)
+            groups.append(traces)
+        return tuple(groups)
+
+
+class RecordingBackend(CaptureBackend):
+    """Wraps another capture backend and appends everything it captures with capture() to the store of
+    the sbox, device and AES mode under root, see store_directory, and both groups of every
+    capture_tvla() to their stores, see tvla_directory. The stores are tagged with them too, and
+    appending to a store of other traces raises ValueError."""
+
+    def __init__(self, backend, root):
+        self.backend = backend
+        self.root = root
+        self.store = None
+        self.tvla_stores = [None] * len(TVLA_GROUPS)
+
+    def prepare(self, sbox_name, platform="CWNANO", aes_mode=None):
+        self.backend.prepare(sbox_name, platform, aes_mode)
+        self.key = self.backend.key
+        self.firmware_id = self.backend.firmware_id
+        self.store = None
+        self.tvla_stores = [None] * len(TVLA_GROUPS)
+        self.sbox_name = sbox_name
+        self.platform = platform
+        self.aes_mode = aes_mode
+
+    def _open(self, directory, traces, **tags):
+        return TraceStore.open_or_create(
+            directory, np.shape(traces)[1], np.asarray(traces).dtype,
+            sbox_name=self.sbox_name, device=self.platform, aes_mode=self.aes_mode, **tags,
+        )
+
+    def capture(self, N):
+        textins, traces = self.backend.capture(N)
+        if self.store is None:
+            self.store = self._open(store_directory(self.root, self.sbox_name, self.platform, self.aes_mode), traces)
+        self.store.append(textins, traces, self.key)
+        return textins, traces
+
+    # capture_tvla does not return the textins of the random group, so they are stored as zeros
+    def capture_tvla(self, N):
+        groups = self.backend.capture_tvla(N)
+        for i, (group, textin, traces) in enumerate(zip(TVLA_GROUPS, [TVLA_FIXED_TEXT, bytes(16)], groups)):
+            if len(traces) == 0:
+                continue
+            if self.tvla_stores[i] is None:
+                directory = tvla_directory(self.root, self.sbox_name, self.platform, self.aes_mode, group)
+                self.tvla_stores[i] = self._open(directory, traces, capture="tvla", group=group)
+            textins = np.tile(np.frombuffer(bytes(textin), dtype=np.uint8), (len(traces), 1))
+            self.tvla_stores[i].append(textins, traces, self.key)
+        return groups
+
+    def close(self):
+        self.backend.close()
+        self.store = None
+        self.tvla_stores = [None] * len(TVLA_GROUPS)
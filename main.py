@@ -1,44 +1,87 @@
-import pickle
-from chipwhisperer_minimal.metrics import num_traces, tvla, cpa_metrics, dpa_metrics, tvla_metrics
+from chipwhisperer_minimal.metrics import num_traces, tvla, cpa_metrics, dpa_metrics, template_metrics, tvla_metrics
+from chipwhisperer_minimal.campaign import campaign_units, run_campaign
+from chipwhisperer_minimal.result_store import ResultStore, DEFAULT_PATH
+from chipwhisperer_minimal import instrumentation
+from chipwhisperer_minimal.sbox_catalog import load_catalog, catalog_exists
+from chipwhisperer_minimal.parallel_attacks import AttackPool
 
 def main():
-    try: 
-        with open("./chipwhisperer_minimal/generate_c/sboxes_info.pkl", "rb") as f:
-            sboxes_df = pickle.load(f)
-    except FileNotFoundError:
-        print("No pickled sbox info found, generating by running sboxes_info.py")
+    if not catalog_exists():
+        print("No sbox catalog found, generating by running sboxes_info.py")
         import sboxes_info
         sboxes_info.main()
-        with open("./chipwhisperer_minimal/generate_c/sboxes_info.pkl", "rb") as f:
-            sboxes_df = pickle.load(f)
-
-    sboxes_dict = sboxes_df.T.to_dict()
+    # name -> {"box": ..., "inverse": ..., metrics}, memory mapped
+    sboxes_dict = load_catalog()
     device = "CWNANO"
     attack_method = "TVLA"
     aes_mode = "CTR"
-    if attack_method.upper() == "TVLA":
-        filename=f"./results/avg_leaks_{device.lower()}_{aes_mode}.txt"
-    else:
-        filename=f"./results/n_traces_{attack_method.lower()}_{device.lower()}.txt"
 
+    # Every run and result is saved to the result store, and sboxes already done are skipped.
+    # Load them with ResultStore(DEFAULT_PATH).load_results(), or as sboxes_results.csv with
+    # `python -m chipwhisperer_minimal.result_store --csv ./results/sboxes_results.csv`
+    store_path = DEFAULT_PATH
+
+    # Times the firmware builds, programming, captures and attacks into chipwhisperer/logs/instrumentation.jsonl,
+    # and prints the per-stage summary at the end. Campaign workers forked from here write their events
+    # to the same file, see instrumentation.summarize_file.
+    instrument = False
+    if instrument:
+        instrumentation.enable()
+
+    # Attached capture targets, as (platform, backend factory). With any listed, the sboxes are run as a
+    # campaign spread over all of them instead of one by one on `device`, e.g. with
+    # functools.partial and chipwhisperer_minimal.capture.ChipWhispererBackend:
+    #   ("CWNANO", partial(ChipWhispererBackend, serial_number="...")),
+    #   ("CWLITEARM", partial(ChipWhispererBackend, serial_number="...")),
+    targets = []
+    if targets:
+        platforms = sorted({platform for platform, _ in targets})
+        # aes_mode is for TVLA, the key recovery attacks are run on ECB as below
+        modes = [aes_mode] if attack_method.upper() == "TVLA" else ["ECB"]
+        units = campaign_units(sboxes_dict.keys(), [attack_method], modes, platforms)
+        run_campaign(units, targets, sboxes_dict, store_path=store_path)
+        finish(instrument, campaign=True)
+        return
+
+    # With a number of workers, the CPA and DPA attacks of the whole run are sharded over one process
+    # pool of that many workers, see parallel_attacks.py
+    attack_workers = None
+    pool = AttackPool(attack_workers) if attack_workers else None
+    cpa, dpa = cpa_metrics, dpa_metrics
+    if pool is not None:
+        cpa = dict(cpa_metrics, attack_function=pool.cpa_run)
+        dpa = dict(dpa_metrics, attack_function=pool.dpa_run)
 
+    store = ResultStore(store_path)
     for sbox_name in sboxes_dict.keys():
         sbox = sboxes_dict[sbox_name]["box"]
         if attack_method.upper() == "TVLA":
-            avg_percent_leaks = tvla(sbox_name, device, tvla_metrics, aes_mode)
-            with open(filename, "a") as f:
-                print(sbox_name, avg_percent_leaks, file=f)
-        
+            tvla(sbox_name, device, tvla_metrics, aes_mode, store=store)
+
         elif attack_method.upper() == "CPA" or attack_method.upper() == "DPA": 
             if attack_method.upper() == "CPA":
-                N_threshold = num_traces(sbox_name, sbox, device, cpa_metrics)
+                num_traces(sbox_name, sbox, device, cpa, store=store)
             else:
-                N_threshold = num_traces(sbox_name, sbox, device, dpa_metrics)
-            with open(filename, "a") as f:
-                print(sbox_name, N_threshold, file=f)
+                num_traces(sbox_name, sbox, device, dpa, store=store)
+        elif attack_method.upper() == "TEMPLATE":
+            num_traces(sbox_name, sbox, device, template_metrics, store=store)
         else:
-            print("Invalid attack method given! Please input a valid attack method: `CPA`, `DPA` or `TVLA`.")
+            print("Invalid attack method given! Please input a valid attack method: `CPA`, `DPA`, `TEMPLATE` or `TVLA`.")
             continue
+    store.close()
+    if pool is not None:
+        pool.shutdown()
+    finish(instrument)
+
+# Prints the instrumentation summary. The work of a campaign is done in its worker processes, so the
+# summary is built from the events they all wrote to the file, not from this process's recorder.
+def finish(instrument, campaign=False):
+    if instrument:
+        recorder = instrumentation.disable()
+        if campaign:
+            print(instrumentation.format_summary(instrumentation.summarize_file(recorder.path, since=recorder.started)))
+        else:
+            print(recorder.report())
     print("All done!")
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import numpy as np
+
+# NumPy kernels for the s-box metrics that sboxes_info used to take from SageMath. Every function
+# takes the output values of an s-box, a list or array of 2^m entries, and follows the definitions
+# of sage.crypto.sbox.SBox.
+
+def hamming_weights(size):
+    x = np.arange(size)
+    weights = np.zeros(size, dtype=np.int64)
+    while x.any():
+        weights += x & 1
+        x = x >> 1
+    return weights
+
+def walsh_hadamard(a, axis=-1):
+    """Fast Walsh-Hadamard transform of an integer array along one axis of length 2^k"""
+    a = np.moveaxis(np.asarray(a, dtype=np.int64), axis, -1).copy()
+    size = a.shape[-1]
+    h = 1
+    while h < size:
+        blocks = a.reshape(a.shape[:-1] + (size // (2 * h), 2, h))
+        left = blocks[..., 0, :].copy()
+        blocks[..., 0, :] += blocks[..., 1, :]
+        blocks[..., 1, :] = left - blocks[..., 1, :]
+        h *= 2
+    return np.moveaxis(a, -1, axis)
+
+def dimensions(values):
+    values = np.asarray(values, dtype=np.int64)
+    m = int(np.log2(len(values)))
+    # Like Sage, the output size is the bit length of the largest output
+    n = max(1, int(values.max()).bit_length())
+    return values, m, n
+
+def is_permutation(values):
+    values, m, n = dimensions(values)
+    return m == n and len(np.unique(values)) == len(values)
+
+def inverse(values):
+    values = np.asarray(values, dtype=np.int64)
+    inv = np.zeros_like(values)
+    inv[values] = np.arange(len(values))
+    return inv
+
+def walsh_spectrum(values):
+    """W[a][b] = sum over x of (-1)^(a.x xor b.S(x)), for input mask a and output mask b"""
+    values, m, n = dimensions(values)
+    parity = hamming_weights(2**n) & 1
+    # Row b holds the component function b.S(x) as +-1
+    components = 1 - 2 * parity[np.arange(2**n)[:, None] & values[None, :]]
+    return walsh_hadamard(components, axis=1).T
+
+def linear_approximation_table(values):
+    """LAT[a][b] = #{x : a.x = b.S(x)} - 2^(m-1), Sage's absolute bias scale"""
+    return walsh_spectrum(values) // 2
+
+def difference_distribution_table(values):
+    """DDT[a][b] = #{x : S(x) xor S(x xor a) = b}, computed as the XOR convolution of the s-box with
+    itself: the 2D Walsh-Hadamard transform of the squared Walsh spectrum"""
+    values, m, n = dimensions(values)
+    squared = walsh_spectrum(values)**2
+    return walsh_hadamard(walsh_hadamard(squared, axis=0), axis=1) >> (m + n)
+
+def boomerang_connectivity_table(values):
+    """BCT[a][b] = #{x : S^-1(S(x) xor b) xor S^-1(S(x xor a) xor b) = a}, for a permutation.
+
+    With y = S(x) and g_a(y) = y xor S(S^-1(y) xor a), the condition is g_a(y) = g_a(y xor b), so
+    BCT[a][b] counts the pairs of outputs y, y xor b in the same class of g_a. The classes have the
+    sizes of the DDT entries, so they are small and the pairs are found by sorting."""
+    values = np.asarray(values, dtype=np.int64)
+    size = len(values)
+    X = np.arange(size)
+    inv = inverse(values)
+    # g_0 is constant, so the first row is all size
+    g = X[None, :] ^ values[inv[None, :] ^ X[1:, None]]
+    keys = (X[1:, None] * size + g).ravel()
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    a_index = order // size + 1
+    ys = X[order % size]
+
+    bct = np.zeros(size * size, dtype=np.int64)
+    bct[:size] = size
+    bct[X * size] = size
+    # Members of a class are contiguous once sorted, k apart for every k below the class size
+    k = 1
+    while k < len(keys):
+        same = np.flatnonzero(sorted_keys[k:] == sorted_keys[:-k])
+        if len(same) == 0:
+            break
+        bct += 2 * np.bincount(a_index[same] * size + (ys[same] ^ ys[same + k]), minlength=size * size)
+        k += 1
+    return bct.reshape(size, size)
+
+def maximal_linear_bias_absolute(values, lat=None):
+    lat = linear_approximation_table(values) if lat is None else lat
+    return int(np.abs(lat).ravel()[1:].max())
+
+def nonlinearity(values, lat=None):
+    values, m, n = dimensions(values)
+    return (1 << (m - 1)) - maximal_linear_bias_absolute(values, lat)
+
+def linearity(values, lat=None):
+    return maximal_linear_bias_absolute(values, lat) << 1
+
+def maximal_linear_bias_relative(values, lat=None):
+    values, m, n = dimensions(values)
+    return maximal_linear_bias_absolute(values, lat) / 2.0**(m - 1)
+
+def maximal_difference_probability(values, ddt=None):
+    values, m, n = dimensions(values)
+    ddt = difference_distribution_table(values) if ddt is None else ddt
+    return int(ddt.ravel()[1:].max()) / 2.0**m
+
+def boomerang_uniformity(values, bct=None):
+    bct = boomerang_connectivity_table(values) if bct is None else bct
+    return int(bct[1:, 1:].max())
+
+def differential_branch_number(values, ddt=None):
+    """Minimum of wt(a) + wt(b) over the differentials a -> b that occur, a != 0"""
+    values, m, n = dimensions(values)
+    ddt = difference_distribution_table(values) if ddt is None else ddt
+    weights = hamming_weights(2**m)[:, None] + hamming_weights(2**n)[None, :]
+    possible = ddt > 0
+    possible[0, :] = False
+    return int(weights[possible].min())
+
+def linear_branch_number(values, lat=None):
+    """Minimum of wt(a) + wt(b) over the linear approximations with nonzero bias, b != 0"""
+    values, m, n = dimensions(values)
+    lat = linear_approximation_table(values) if lat is None else lat
+    weights = hamming_weights(2**m)[:, None] + hamming_weights(2**n)[None, :]
+    biased = lat != 0
+    biased[:, 0] = False
+    return int(weights[biased].min())
@@ -0,0 +1,282 @@
+import argparse
+import heapq
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(current_dir)
+import sbox_metrics
+from sboxes_info import sbox_bic, avg_sac, cached_row
+from chipwhisperer_minimal.sbox_catalog import CATALOG_DIR, load_catalog, write_catalog, catalog_exists
+from chipwhisperer_minimal.generate_c.generate_c_files import read_parts, generate_c_file
+
+# Search of the space of 8-bit s-boxes. Candidates come from families: random permutations, affine
+# equivalents of the catalog s-boxes, and their XOR complements. They are scored in batches on a
+# process pool, cheapest metric first, and dropped as soon as they can not make the top K:
+#
+#   1. differential uniformity (max of the DDT), about 0.5 ms
+#   2. SAC and BIC, about 0.5 ms
+#   3. nonlinearity, from the LAT, about 3 ms
+#   4. boomerang uniformity, from the BCT, about 5 ms
+#
+# Affine equivalents and complements share 1, 3 and 4 with their base, so only their SAC and BIC are
+# computed.
+#
+# Candidates are ranked by rank_key. The top K are written into the s-box catalog as the search goes,
+# with their full sboxes_info row, and as C files that generate_c_files can build.
+#
+#   python sbox_search.py --random 100000 --affine 1000 --complements --top 20
+
+GENERATE_C_DIR = f"{current_dir}/chipwhisperer_minimal/generate_c"
+
+# Larger is better: low differential uniformity, high nonlinearity, low boomerang uniformity, SAC
+# close to 1/2 and low BIC, compared in that order. The first entries only need the cheap metrics,
+# which is what lets a candidate be pruned before the expensive ones.
+def rank_key(metrics):
+    return (
+        -metrics["differential_uniformity"],
+        metrics["nonlinearity"],
+        -metrics["boomerang_uniformity"],
+        -abs(metrics["sac"] - 0.5),
+        -metrics["bic"],
+    )
+
+# Candidate families, each yielding (name, values, known) with values a (256,) uint8 array and known
+# the metrics the candidate is known to share with its base, which are then not computed again
+
+def random_permutations(count, rng):
+    for i in range(count):
+        yield f"random_{i}", rng.permutation(256).astype(np.uint8), {}
+
+# Metrics that every affine equivalent of the s-box has too
+def affine_invariants(values):
+    return {
+        "differential_uniformity": differential_uniformity(values),
+        "nonlinearity": sbox_metrics.nonlinearity(values),
+        "boomerang_uniformity": sbox_metrics.boomerang_uniformity(values),
+    }
+
+# Table of the linear map of GF(2)^8 whose columns, the images of the basis bits, are `columns`
+def linear_table(columns):
+    table = np.zeros(256, dtype=np.uint8)
+    for bit, column in enumerate(columns):
+        table[(np.arange(256) >> bit) & 1 == 1] ^= np.uint8(column)
+    return table
+
+def random_invertible_table(rng):
+    while True:
+        table = linear_table(rng.integers(0, 256, 8, dtype=np.uint8))
+        if len(np.unique(table)) == 256:
+            return table
+
+def affine_equivalents(base_name, base, count, rng):
+    """B(S(A(x) ^ a)) ^ b for random invertible A, B and constants a, b. These keep the
+    differential uniformity, nonlinearity and boomerang uniformity of S, but not its SAC, BIC or
+    leakage."""
+    base = np.asarray(base, dtype=np.uint8)
+    known = affine_invariants(base) if count else {}
+    for i in range(count):
+        a_table, b_table = random_invertible_table(rng), random_invertible_table(rng)
+        a, b = rng.integers(0, 256, 2, dtype=np.uint8)
+        yield f"{base_name}_affine_{i}", b_table[base[a_table ^ a]] ^ b, known
+
+def xor_complements(base_name, base):
+    """S(x) ^ c for every constant c. The n-complements of generate_n_complement are XORs with a
+    constant, so they are all among these. An XOR complement is an affine equivalent."""
+    base = np.asarray(base, dtype=np.uint8)
+    known = affine_invariants(base)
+    for c in range(1, 256):
+        yield f"{base_name}_comp_{c}", base ^ np.uint8(c), known
+
+def differential_uniformity(values):
+    """Largest DDT entry outside the first row, counted directly for an 8-bit s-box"""
+    values = np.asarray(values, dtype=np.int64)
+    x = np.arange(len(values))
+    outputs = values[x[1:, None] ^ x[None, :]] ^ values[None, :]
+    ddt = np.bincount((x[1:, None] * len(values) + outputs).ravel(), minlength=len(values)**2)
+    return int(ddt.max())
+
+# Scores one batch of candidates, cheapest metric first. A candidate is dropped when it fails the
+# limits, or when it ranks below `bound`, the rank_key of the last of the top K when the batch was
+# sent. Returns the metrics of the candidates that are left, and how many were dropped per stage.
+def score_batch(batch, max_differential=None, min_nonlinearity=None, bound=None):
+    scored = []
+    pruned = {"differential_uniformity": 0, "nonlinearity": 0, "boomerang_uniformity": 0}
+    for name, values, known in batch:
+        metrics = dict(known)
+        if "differential_uniformity" not in metrics:
+            metrics["differential_uniformity"] = differential_uniformity(values)
+        if (max_differential is not None and metrics["differential_uniformity"] > max_differential) \
+                or (bound is not None and (-metrics["differential_uniformity"],) < bound[:1]):
+            pruned["differential_uniformity"] += 1
+            continue
+
+        metrics["sac"] = float(avg_sac(values))
+        metrics["bic"] = float(sbox_bic(values))
+        if "nonlinearity" not in metrics:
+            metrics["nonlinearity"] = sbox_metrics.nonlinearity(values)
+        if (min_nonlinearity is not None and metrics["nonlinearity"] < min_nonlinearity) \
+                or (bound is not None and (-metrics["differential_uniformity"], metrics["nonlinearity"]) < bound[:2]):
+            pruned["nonlinearity"] += 1
+            continue
+
+        if "boomerang_uniformity" not in metrics:
+            metrics["boomerang_uniformity"] = sbox_metrics.boomerang_uniformity(values)
+        if bound is not None and rank_key(metrics) < bound:
+            pruned["boomerang_uniformity"] += 1
+            continue
+        scored.append((name, values, metrics))
+    return scored, pruned
+
+def batches(candidates, batch_size):
+    batch = []
+    for candidate in candidates:
+        batch.append(candidate)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TopK:
+    """The K best candidates seen so far, without repeated s-boxes"""
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.seen = set()
+
+    def bound(self):
+        """rank_key a candidate must beat to get in, None while there is room"""
+        return self.heap[0][0] if len(self.heap) == self.k else None
+
+    def push(self, name, values, metrics):
+        values = np.asarray(values, dtype=np.uint8)
+        if values.tobytes() in self.seen:
+            return False
+        entry = (rank_key(metrics), name, values.tobytes(), metrics)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        # Ties go by name, so the top K does not depend on the order the batches finish in
+        elif entry[:2] > self.heap[0][:2]:
+            self.seen.discard(heapq.heapreplace(self.heap, entry)[2])
+        else:
+            return False
+        self.seen.add(entry[2])
+        return True
+
+    def best(self):
+        """(name, values, metrics), best first"""
+        return [(name, np.frombuffer(values, dtype=np.uint8), metrics)
+                for _, name, values, metrics in sorted(self.heap, reverse=True)]
+
+
+# Writes the top K into the catalog under `prefix`, replacing the ones of an earlier checkpoint, and
+# keeps every other s-box of the catalog
+def write_top(top, prefix, directory=CATALOG_DIR):
+    rows = {}
+    if catalog_exists(directory):
+        catalog = load_catalog(directory)
+        rows = {name: catalog[name] for name in catalog if not name.startswith(prefix)}
+    for name, values, _ in top:
+        rows[f"{prefix}{name}"] = cached_row(values)
+    write_catalog(rows, directory)
+
+def write_c_files(top, prefix, c_dir=GENERATE_C_DIR):
+    prelude, postlude, complement = read_parts(GENERATE_C_DIR)
+    for name, values, _ in top:
+        row = cached_row(values)
+        with open(f"{c_dir}/{prefix}{name}.c", "w") as f:
+            f.write(generate_c_file(row, prelude, postlude, complement, GENERATE_C_DIR))
+
+def search(candidates, top_k=20, workers=None, batch_size=64, max_differential=None, min_nonlinearity=None,
+           prefix="search_", directory=CATALOG_DIR, checkpoint=100, c_dir=GENERATE_C_DIR):
+    """Scores the candidates on a pool of `workers` processes (all cores by default) and returns the
+    top K as (name, values, metrics), best first. The top K is written to the catalog every
+    `checkpoint` batches and at the end, and as C files at the end. With directory None, nothing is
+    written."""
+    workers = workers or os.cpu_count()
+    top = TopK(top_k)
+    stats = {"candidates": 0, "differential_uniformity": 0, "nonlinearity": 0, "boomerang_uniformity": 0}
+    start = time.perf_counter()
+    done_batches = 0
+
+    pending = set()
+    candidate_batches = batches(candidates, batch_size)
+    with ProcessPoolExecutor(workers) as executor:
+        while True:
+            # A few batches per worker in flight, each with the bound known when it is sent
+            for batch in candidate_batches:
+                stats["candidates"] += len(batch)
+                pending.add(executor.submit(score_batch, batch, max_differential, min_nonlinearity, top.bound()))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                scored, pruned = future.result()
+                for stage, n in pruned.items():
+                    stats[stage] += n
+                for name, values, metrics in scored:
+                    top.push(name, values, metrics)
+                done_batches += 1
+                if directory is not None and checkpoint and done_batches % checkpoint == 0:
+                    write_top(top.best(), prefix, directory)
+
+    best = top.best()
+    if directory is not None:
+        write_top(best, prefix, directory)
+        if c_dir is not None:
+            write_c_files(best, prefix, c_dir)
+
+    seconds = time.perf_counter() - start
+    print(f"Scored {stats['candidates']} candidates in {seconds:.1f} s ({stats['candidates'] / max(seconds, 1e-9):.0f}/s)")
+    print("Pruned on differential uniformity: {differential_uniformity}, nonlinearity: {nonlinearity}, "
+          "boomerang uniformity: {boomerang_uniformity}".format(**stats))
+    return best
+
+# Every candidate of the families asked for. The ones built from the base s-boxes come first, as
+# they are usually the strongest and so make the top K prune early.
+def candidate_families(bases, random_count=0, affine_count=0, complements=False, seed=None):
+    rng = np.random.default_rng(seed)
+    for base_name, base in bases.items():
+        if complements:
+            yield from xor_complements(base_name, base)
+        yield from affine_equivalents(base_name, base, affine_count, rng)
+    yield from random_permutations(random_count, rng)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search 8-bit s-boxes and add the best ones to the catalog")
+    parser.add_argument("--random", type=int, default=0, help="number of random permutations")
+    parser.add_argument("--affine", type=int, default=0, help="number of affine equivalents of every base s-box")
+    parser.add_argument("--complements", action="store_true", help="add the 255 XOR complements of every base s-box")
+    parser.add_argument("--base", nargs="*", help="catalog s-boxes the families start from, all but earlier search results by default")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--max-differential", type=int, help="drop candidates of larger differential uniformity")
+    parser.add_argument("--min-nonlinearity", type=int, help="drop candidates of smaller nonlinearity")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--prefix", default="search_", help="catalog name prefix of the results")
+    parser.add_argument("--catalog", default=CATALOG_DIR)
+    parser.add_argument("--c-dir", default=GENERATE_C_DIR, help="directory the C files of the top s-boxes are written to")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    bases = {}
+    if args.affine or args.complements:
+        catalog = load_catalog(args.catalog)
+        names = args.base or [name for name in catalog if not name.startswith(args.prefix)]
+        bases = {name: catalog.box(name) for name in names}
+
+    candidates = candidate_families(bases, args.random, args.affine, args.complements, args.seed)
+    best = search(candidates, args.top, args.workers, args.batch_size, args.max_differential, args.min_nonlinearity,
+                  args.prefix, args.catalog, c_dir=args.c_dir)
+    for name, values, metrics in best:
+        print(f"{args.prefix}{name}: " + ", ".join(f"{metric}={value:.4g}" for metric, value in metrics.items()))
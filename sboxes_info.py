@@ -1,69 +1,68 @@
-from sage.all import *
-from sage.crypto.sbox import *
-from sage.crypto.sboxes import sboxes
+import hashlib
 import numpy as np
 import pickle
-import pandas as pd
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(current_dir)
+import sbox_metrics
+from chipwhisperer_minimal.sbox_catalog import CATALOG_DIR, load_catalog, write_catalog, catalog_exists
+
+# The DataFrame the catalog used to be stored as, which --from-pickle converts
+PICKLE_FILENAME = f"{current_dir}/chipwhisperer_minimal/generate_c/sboxes_info.pkl"
+
+# Rows are cached under a hash of the s-box values, bump the version when create_row changes
+CACHE_DIR = f"{current_dir}/chipwhisperer_minimal/generate_c/sbox_cache"
+CACHE_VERSION = 1
+
+# SageMath is only needed for its catalog of named s-boxes, the metrics are computed by sbox_metrics
+try:
+    from sage.crypto.sboxes import sboxes
+except ImportError:
+    sboxes = None
+
+# Output values of a Sage SBox, whose len() is its number of input bits, or of a plain list
+def sbox_values(sbox):
+    if hasattr(sbox, "input_size"):
+        return np.array([int(sbox[X]) for X in range(2**sbox.input_size())], dtype=np.int64)
+    return np.asarray(sbox, dtype=np.int64)
+
+# Avalanche bits of every input bit flip at once: [i, X, j] is bit j of sbox[X] ^ sbox[X ^ 2^i]
+def avalanche_bits(sbox):
+    values = sbox_values(sbox)
+    m = int(np.log2(len(values)))
+    X = np.arange(2**m)
+    flips = X[None, :] ^ (1 << np.arange(m))[:, None]
+    dei = values[None, :] ^ values[flips]
+    return ((dei[:, :, None] >> np.arange(m)) & 1).astype(float)
 
 # Modified from https://github.com/abrari/block-cipher-testing
 # Works only on square s-boxes
 def sbox_bic(sbox):
-
-    maxCorr = 0
-    m = len(sbox)
-    for i in range(m):
-        ei = 2**i 
-        for j in range(m):
-            for k in range(m):
-                if j != k:
-                    avalanche_vec_j = np.zeros(2**m, dtype=float)
-                    avalanche_vec_k = np.zeros(2**m, dtype=float)
-
-                    # Each possible input
-                    for X in range(2**m):
-                        ej = 2**j 
-                        ek = 2**k 
-
-                        dei = sbox[X] ^ sbox[X ^ ei]
-                        dej = (dei & ej) >> j
-                        dek = (dei & ek) >> k 
-
-                        avalanche_vec_j[X] = dej 
-                        avalanche_vec_k[X] = dek
-                    corr = abs(np.corrcoef(avalanche_vec_j, avalanche_vec_k)[0,1])
-                
-                    if maxCorr < corr:
-                        maxCorr = corr
+    bits = avalanche_bits(sbox)
+    m = bits.shape[0]
+
+    # Correlation of every pair (j, k) of avalanche bits, for every flipped input bit i
+    centered = bits - bits.mean(axis=1, keepdims=True)
+    cov = np.einsum("ixj,ixk->ijk", centered, centered)
+    std = np.sqrt(np.einsum("ijj->ij", cov))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = np.abs(cov / (std[:, :, None] * std[:, None, :]))
+
+    # Constant avalanche bits have no correlation, and are skipped like np.corrcoef's nan
+    corr[:, np.arange(m), np.arange(m)] = np.nan
+    corr = corr[~np.isnan(corr)]
+    maxCorr = max(0, corr.max()) if corr.size else 0
     return maxCorr
 
 # Modified version to get the average SAC of an sbox from:
 #       https://github.com/abrari/block-cipher-testing
 def avg_sac(sbox):
-    m = len(sbox)
-    sac_mat = np.array([np.zeros(m, dtype=float) for _ in range(m)])
-
-    for i in range(m):
-        ei = 2**i 
-        for j in range(m):
-            ej = 2**j 
-            for X in range(2**m):
-                dei = sbox[X] ^ sbox[X ^ ei]
-                sac_mat[i][j] += (dei & ej) >> j 
-    
-    output_len = 2**m
-    for i in range(m):
-        for j in range(m):
-            sac_mat[i][j] /= output_len
-
-    sum = 0 
-    for i in range(m):
-        sum += np.sum(sac_mat[i])
-    avg = sum / (m**2)
+    # sac_mat[i][j] is the probability that flipping input bit i flips output bit j
+    sac_mat = avalanche_bits(sbox).mean(axis=1)
+    avg = sac_mat.mean()
     return avg 
 
 # Adding the 8 sboxes from the paper
@@ -77,42 +76,118 @@ def sboxes_8():
     return sboxes
 
 def create_row(sbox):
+    values = sbox_values(sbox)
+    permutation = sbox_metrics.is_permutation(values)
+    lat = sbox_metrics.linear_approximation_table(values)
+    ddt = sbox_metrics.difference_distribution_table(values)
+
     row = {}
-    row["box"] = [num for num in sbox] 
-    row["inverse"] = [num for num in sbox.inverse()] if sbox.is_permutation() else []
-    row["nonlinearity"] = int(sbox.nonlinearity())
-    row["linear_probability"] = float(sbox.maximal_linear_bias_relative())
-    row["differential_probability"] = float(sbox.maximal_difference_probability())
-    row["boomerang_uniformity"] = int(sbox.boomerang_uniformity()) if sbox.is_permutation() else -1
-    row["diff_branch"] = int(sbox.differential_branch_number())
-    row["linear_branch"] = int(sbox.linear_branch_number())
-    row["linearity"] = int(sbox.linearity())
-    row["bic"] = sbox_bic(sbox) 
-    row["sac"] = avg_sac(sbox) 
+    row["box"] = [int(num) for num in values]
+    row["inverse"] = [int(num) for num in sbox_metrics.inverse(values)] if permutation else []
+    row["nonlinearity"] = sbox_metrics.nonlinearity(values, lat)
+    row["linear_probability"] = sbox_metrics.maximal_linear_bias_relative(values, lat)
+    row["differential_probability"] = sbox_metrics.maximal_difference_probability(values, ddt)
+    row["boomerang_uniformity"] = sbox_metrics.boomerang_uniformity(values) if permutation else -1
+    row["diff_branch"] = sbox_metrics.differential_branch_number(values, ddt)
+    row["linear_branch"] = sbox_metrics.linear_branch_number(values, lat)
+    row["linearity"] = sbox_metrics.linearity(values, lat)
+    row["bic"] = sbox_bic(values)
+    row["sac"] = avg_sac(values)
     return row 
 
-def main():
-    pickle_filename = f"{current_dir}/chipwhisperer_minimal/generate_c/sboxes_info.pkl"
-    df_dict = {}
-
-    for name, sbox in sboxes.items():
-        if len(sbox) == 8:
-            print("Calculating info:", name)
-            df_dict[name] = create_row(sbox)
-
-    # Add the 8 sboxes
+# The 8-bit s-boxes of Sage's catalog. Without Sage, they are taken from the earlier catalog instead.
+def catalog_sboxes(directory=CATALOG_DIR):
+    if sboxes is not None:
+        return {name: sbox_values(sbox) for name, sbox in sboxes.items() if len(sbox) == 8}
+    if not catalog_exists(directory) and os.path.exists(PICKLE_FILENAME):
+        from_pickle(PICKLE_FILENAME, directory)
+    print("SageMath not found, reusing the catalog s-boxes of", directory)
+    catalog = load_catalog(directory)
     sb_8 = sboxes_8()
-    print("doing sboxes_8():")
-    for name in sb_8.keys():
-        sbox = SBox(*sb_8[name])
-        print("Calculating info:", name)
-        df_dict[name] = create_row(sbox)
+    return {name: np.array(catalog.box(name)) for name in catalog if name not in sb_8}
+
+def sbox_hash(sbox):
+    values = np.asarray(sbox_values(sbox), dtype=np.int64)
+    return hashlib.sha256(f"v{CACHE_VERSION}:".encode() + values.tobytes()).hexdigest()
+
+def cached_row(sbox, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, f"{sbox_hash(sbox)}.pkl")
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+
+    row = create_row(sbox)
+    # Written under a unique name and renamed, so that concurrent workers never see half a row
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+        pickle.dump(row, f)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return row
+
+# Rows of all the named sboxes. Cached rows are loaded, the others are computed on a pool of
+# `workers` processes (all cores by default) and added to the cache.
+def build_rows(named_sboxes, workers=None, cache_dir=CACHE_DIR):
+    rows = {}
+    missing = []
+    for name, sbox in named_sboxes.items():
+        path = os.path.join(cache_dir, f"{sbox_hash(sbox)}.pkl")
+        if os.path.exists(path):
+            rows[name] = cached_row(sbox, cache_dir)
+        else:
+            missing.append(name)
+    print(f"{len(rows)} cached sboxes, calculating info of {len(missing)}")
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            sbox_list = [named_sboxes[name] for name in missing]
+            for name, row in zip(missing, executor.map(cached_row, sbox_list, [cache_dir] * len(missing), chunksize=8)):
+                print("Calculated info:", name)
+                rows[name] = row
+
+    # Keep the order of named_sboxes
+    return {name: rows[name] for name in named_sboxes.keys()}
+
+def main(workers=None, directory=CATALOG_DIR):
+    named_sboxes = catalog_sboxes(directory)
+    # Add the 8 sboxes
+    named_sboxes.update(sboxes_8())
+    rows = build_rows(named_sboxes, workers)
 
     print("\nFinished calculating sbox info!\n")
-    df = pd.DataFrame.from_dict(df_dict).T
-    with open(pickle_filename, "wb") as f:     
-        pickle.dump(df, f)
+    write_catalog(rows, directory)
     return
 
+# Converts the sboxes_info.pkl DataFrame of earlier versions into a catalog
+def from_pickle(pickle_filename=PICKLE_FILENAME, directory=CATALOG_DIR):
+    with open(pickle_filename, "rb") as f:
+        rows = pickle.load(f).T.to_dict()
+    write_catalog(rows, directory)
+    print(f"Wrote the {len(rows)} sboxes of {pickle_filename} to {directory}")
+
+# Recomputes every row of the catalog and reports the metrics that differ from the stored ones
+def verify(directory=CATALOG_DIR):
+    sbox_dict = load_catalog(directory)
+
+    mismatches = 0
+    for name, stored in sbox_dict.items():
+        row = create_row(stored["box"])
+        for metric, value in row.items():
+            if metric in ["box", "inverse"]:
+                same = list(value) == list(stored[metric])
+            else:
+                same = np.isclose(value, stored[metric])
+            if not same:
+                print(f"{name}: {metric} is {value}, stored {stored[metric]}")
+                mismatches += 1
+    print(f"Checked {len(sbox_dict)} sboxes, {mismatches} mismatches")
+    return mismatches == 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--verify" in sys.argv:
+        verify()
+    elif "--from-pickle" in sys.argv:
+        from_pickle()
+    else:
+        main()
@@ -0,0 +1,22 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The tests import the repository modules as main.py does, from the repository root
+root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(root_dir)
+
+from chipwhisperer_minimal.simulator import LeakageSimulator
+
+
+@pytest.fixture
+def sbox():
+    return np.random.default_rng(0).permutation(256).tolist()
+
+# Small simulated capture of the sbox: (textins, traces)
+@pytest.fixture
+def simulated(sbox):
+    simulator = LeakageSimulator(sbox, samples=40, offset=4, spacing=2, seed=1)
+    textins = np.random.default_rng(2).integers(0, 256, (60, 16), dtype=np.uint8)
+    return textins, simulator.traces(textins).astype(np.float64)
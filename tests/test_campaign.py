@@ -0,0 +1,25 @@
+from functools import partial
+from chipwhisperer_minimal.campaign import campaign_units, run_campaign
+from chipwhisperer_minimal.result_store import ResultStore
+from chipwhisperer_minimal.simulator import SimulatorBackend
+
+def test_campaign_on_two_simulated_targets(tmp_path, sbox):
+    sboxes = {"A": sbox, "B": sbox[::-1]}
+    targets = [("CWNANO", partial(SimulatorBackend, sboxes, seed=seed, samples=40, offset=4, spacing=2)) for seed in range(2)]
+    units = campaign_units(sboxes.keys(), ["CPA"], ["ECB"], ["CWNANO"]) + [("A", "TVLA", "CTR", "CWNANO")]
+    path = str(tmp_path / "results.db")
+
+    finished = run_campaign(units, targets, sboxes, store_path=path)
+    assert set(finished) == set(units)
+    for sbox_name in sboxes:
+        assert 0 < finished[(sbox_name, "CPA", "ECB", "CWNANO")] < 300
+    assert 0 <= finished[("A", "TVLA", "CTR", "CWNANO")] <= 100
+
+    store = ResultStore(path)
+    assert store.completed_units() == {("A", "CWNANO", "CPA", "ECB"), ("B", "CWNANO", "CPA", "ECB"), ("A", "CWNANO", "TVLA", "CTR")}
+    for sbox_name, method, aes_mode, platform in units:
+        assert store.result((sbox_name, platform, method, aes_mode)) == finished[(sbox_name, method, aes_mode, platform)]
+    store.close()
+
+    # A second campaign finds every unit done
+    assert run_campaign(units, targets, sboxes, store_path=path) == {}
@@ -0,0 +1,25 @@
+import numpy as np
+from chipwhisperer_minimal.capture import ReplayBackend, save_batch
+from chipwhisperer_minimal.helper_functions import KNOWN_KEY
+from chipwhisperer_minimal.metrics import num_traces, cpa_metrics
+from chipwhisperer_minimal.simulator import LeakageSimulator
+
+def test_replay_attacks_the_recorded_key(tmp_path, sbox):
+    key = list(range(16))
+    assert key != list(KNOWN_KEY)
+    simulator = LeakageSimulator(sbox, key, samples=40, offset=4, spacing=2, noise=0.5, seed=3)
+    rng = np.random.default_rng(4)
+    for _ in range(4):
+        textins = rng.integers(0, 256, (50, 16), dtype=np.uint8)
+        save_batch(str(tmp_path / "AES"), textins, np.tile(key, (50, 1)), simulator.traces(textins))
+
+    backend = ReplayBackend(str(tmp_path))
+    backend.prepare("AES")
+    assert backend.key == key
+
+    # The same result with and without a pool, which is captured before the first attack
+    metrics = dict(cpa_metrics, METRIC_HIGH=60, TOTAL_RUNS=5)
+    direct = num_traces("AES", sbox, metrics=metrics, backend=ReplayBackend(str(tmp_path)))
+    pooled = num_traces("AES", sbox, metrics=metrics, backend=ReplayBackend(str(tmp_path)), pool_size=200, seed=0)
+    assert 0 < direct < 60
+    assert 0 < pooled < 60
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from scipy.stats import ttest_ind
+from chipwhisperer_minimal.online_attacks import CPAAccumulator, DPAAccumulator, TVLAAccumulator, WelfordAccumulator
+from chipwhisperer_minimal.sca_attacks import cpa_engine, dpa_engine
+
+def test_tvla_accumulator_matches_welch_ttest():
+    rng = np.random.default_rng(0)
+    fixed = rng.normal(0.1, 1.0, (400, 30))
+    random = rng.normal(0.0, 2.0, (360, 30))
+
+    accumulator = TVLAAccumulator()
+    # Uneven batches, split as tvla_run splits the groups
+    for split, (fixed_split, random_split) in enumerate([(fixed[:200], random[:180]), (fixed[200:], random[180:])]):
+        for start in range(0, 200, 70):
+            accumulator.add_traces(fixed_split[start:start + 70], random_split[start:start + 70], split)
+
+    expected = [
+        ttest_ind(fixed[:200], random[:180], axis=0, equal_var=False)[0],
+        ttest_ind(fixed[200:], random[180:], axis=0, equal_var=False)[0],
+    ]
+    np.testing.assert_allclose(accumulator.t_statistics(), expected, rtol=1e-10)
+
+def test_welford_variance_needs_two_traces():
+    accumulator = WelfordAccumulator()
+    accumulator.add_traces(np.ones((1, 3)))
+    assert np.all(np.isnan(accumulator.variance()))
+    accumulator.add_traces(np.zeros((1, 3)))
+    np.testing.assert_allclose(accumulator.variance(), 0.5)
+
+# Uneven batches, with an empty one, give the batch engine's result on all the traces
+@pytest.mark.parametrize("accumulator, engine", [
+    (lambda sbox: CPAAccumulator(sbox), cpa_engine),
+    (lambda sbox: DPAAccumulator(sbox, bitnum=5), lambda *args: dpa_engine(*args, bitnum=5)),
+])
+def test_accumulators_match_engines(sbox, simulated, accumulator, engine):
+    textins, traces = simulated
+    online = accumulator(sbox)
+    for start, stop in [(0, 7), (7, 7), (7, 31), (31, 60)]:
+        online.add_traces(textins[start:stop], traces[start:stop])
+    assert online.n == len(traces)
+
+    key_guess, peaks = engine(sbox, textins, traces)
+    assert online.key_guess() == key_guess
+    np.testing.assert_allclose(online.scores()[np.arange(16), key_guess], peaks, rtol=1e-10)
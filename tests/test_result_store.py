@@ -0,0 +1,51 @@
+import numpy as np
+from chipwhisperer_minimal.capture import CaptureBackend
+from chipwhisperer_minimal.metrics import num_traces, cpa_metrics
+from chipwhisperer_minimal.result_store import ResultStore
+from chipwhisperer_minimal.simulator import SimulatorBackend
+
+class CountingBackend(CaptureBackend):
+    """Simulated captures, counting the traces asked for"""
+
+    def __init__(self, sboxes):
+        self.backend = SimulatorBackend(sboxes, seed=0, samples=40, offset=4, spacing=2)
+        self.key = self.backend.key
+        self.prepared = 0
+        self.captured = 0
+
+    def prepare(self, sbox_name, platform="CWNANO", aes_mode=None):
+        self.prepared += 1
+        self.backend.prepare(sbox_name, platform, aes_mode)
+
+    def capture(self, N):
+        self.captured += N
+        return self.backend.capture(N)
+
+def test_finished_unit_is_skipped(tmp_path, sbox):
+    store = ResultStore(str(tmp_path / "results.db"))
+    metrics = dict(cpa_metrics, METRIC_HIGH=100, TOTAL_RUNS=4)
+    backend = CountingBackend({"AES": sbox})
+    first = num_traces("AES", sbox, "CWNANO", metrics, backend=backend, store=store)
+    assert store.result(("AES", "CWNANO", "CPA", "ECB")) == first
+
+    again = CountingBackend({"AES": sbox})
+    assert num_traces("AES", sbox, "CWNANO", metrics, backend=again, store=store) == first
+    assert again.prepared == 0 and again.captured == 0
+    store.close()
+
+def test_done_runs_are_not_captured_again(tmp_path, sbox):
+    store = ResultStore(str(tmp_path / "results.db"))
+    metrics = dict(cpa_metrics, METRIC_HIGH=100, TOTAL_RUNS=4)
+    unit = ("AES", "CWNANO", "CPA", "ECB")
+    # Every run of the first midpoint was done before an interruption
+    for i in range(4):
+        store.record_run(unit, 50, i, 1)
+
+    backend = CountingBackend({"AES": sbox})
+    num_traces("AES", sbox, "CWNANO", metrics, backend=backend, store=store)
+    runs = store.load_runs()
+    later = runs[runs["n_traces"] != 50]
+    assert len(later) > 0
+    # Only the runs of the later midpoints were captured, each with its own number of traces
+    assert backend.captured == later["n_traces"].sum()
+    store.close()
@@ -0,0 +1,61 @@
+import warnings
+import numpy as np
+import pytest
+import sbox_metrics
+from sboxes_info import avg_sac, sbox_bic
+
+# The AES s-box: the inverse in GF(2^8), then the affine map
+def aes_sbox():
+    def multiply(a, b):
+        product = 0
+        while b:
+            if b & 1:
+                product ^= a
+            a = ((a << 1) ^ (0x1b if a & 0x80 else 0)) & 0xff
+            b >>= 1
+        return product
+    inverses = [0] + [next(y for y in range(1, 256) if multiply(x, y) == 1) for x in range(1, 256)]
+    rotate = lambda x, i: ((x << i) | (x >> (8 - i))) & 0xff
+    return [x ^ rotate(x, 1) ^ rotate(x, 2) ^ rotate(x, 3) ^ rotate(x, 4) ^ 0x63 for x in inverses]
+
+def test_aes_sbox_metrics():
+    values = np.asarray(aes_sbox())
+    assert values[:4].tolist() == [0x63, 0x7c, 0x77, 0x7b]
+    assert sbox_metrics.is_permutation(values)
+    assert sbox_metrics.nonlinearity(values) == 112
+    assert int(sbox_metrics.difference_distribution_table(values).ravel()[1:].max()) == 4
+    assert sbox_metrics.maximal_difference_probability(values) == 4 / 256
+    assert sbox_metrics.boomerang_uniformity(values) == 6
+    assert sbox_metrics.linearity(values) == 32
+
+
+# sbox_bic and avg_sac as they were before avalanche_bits, one avalanche vector at a time
+def loop_bic(sbox, m=8):
+    maxCorr = 0
+    for i in range(m):
+        for j in range(m):
+            for k in range(m):
+                if j != k:
+                    dei = [sbox[X] ^ sbox[X ^ 2**i] for X in range(2**m)]
+                    avalanche_vec_j = np.array([(d >> j) & 1 for d in dei], dtype=float)
+                    avalanche_vec_k = np.array([(d >> k) & 1 for d in dei], dtype=float)
+                    # A constant vector gives nan, which is never above maxCorr
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore", RuntimeWarning)
+                        corr = abs(np.corrcoef(avalanche_vec_j, avalanche_vec_k)[0, 1])
+                    if maxCorr < corr:
+                        maxCorr = corr
+    return maxCorr
+
+def loop_sac(sbox, m=8):
+    sac_mat = np.zeros((m, m))
+    for i in range(m):
+        for j in range(m):
+            for X in range(2**m):
+                sac_mat[i][j] += ((sbox[X] ^ sbox[X ^ 2**i]) >> j) & 1
+    return (sac_mat / 2**m).sum() / m**2
+
+@pytest.mark.parametrize("values", [aes_sbox(), np.random.default_rng(5).permutation(256).tolist()])
+def test_bic_and_sac_match_loops(values):
+    np.testing.assert_allclose(sbox_bic(values), loop_bic(values), rtol=1e-12)
+    np.testing.assert_allclose(avg_sac(values), loop_sac(values), rtol=1e-12)
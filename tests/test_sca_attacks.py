@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from chipwhisperer_minimal.sca_attacks import HW, aes_internal, calculate_diffs, cpa_engine, cpa_run, dpa_engine, dpa_run
+
+# cpa_run as it was before cpa_engine, one guess at a time. Returns the key guess and the peak
+# absolute correlation of every byte.
+def loop_cpa(sbox, textin_array, trace_array):
+    t_bar = trace_array.mean(axis=0)
+    o_t = np.sqrt(np.sum((trace_array - t_bar)**2, axis=0))
+    key_guess, peaks = [], []
+    for bnum in range(16):
+        maxcpa = [0] * 256
+        for kguess in range(256):
+            hws = np.array([[HW[aes_internal(sbox, textin[bnum], kguess)] for textin in textin_array]]).transpose()
+            hws_bar = hws.mean(axis=0)
+            o_hws = np.sqrt(np.sum((hws - hws_bar)**2, axis=0))
+            covariance = np.sum((trace_array - t_bar) * (hws - hws_bar), axis=0)
+            maxcpa[kguess] = max(abs(covariance / (o_t * o_hws)))
+        key_guess.append(np.argmax(maxcpa))
+        peaks.append(max(maxcpa))
+    return key_guess, np.asarray(peaks)
+
+def test_cpa_engine_matches_loop(sbox, simulated):
+    textins, traces = simulated
+    key_guess, peaks = cpa_engine(sbox, textins, traces)
+    loop_guess, loop_peaks = loop_cpa(sbox, textins, traces)
+    assert key_guess == loop_guess
+    np.testing.assert_allclose(peaks, loop_peaks, rtol=1e-10)
+    assert cpa_run(sbox, textins, traces) == loop_guess
+
+
+# dpa_run as it was before dpa_engine, one guess at a time with calculate_diffs
+def loop_dpa(sbox, textin_array, trace_array, bitnum=0):
+    key_guess, peaks = [], []
+    for subkey in range(16):
+        max_diffs = [np.max(calculate_diffs(sbox, textin_array, trace_array, guess, subkey, bitnum)) for guess in range(256)]
+        best = np.argsort(max_diffs)[::-1][0]
+        key_guess.append(best)
+        peaks.append(max_diffs[best])
+    return key_guess, np.asarray(peaks)
+
+@pytest.mark.parametrize("bitnum", [0, 5])
+def test_dpa_engine_matches_loop(sbox, simulated, bitnum):
+    textins, traces = simulated
+    key_guess, peaks = dpa_engine(sbox, textins, traces, bitnum)
+    loop_guess, loop_peaks = loop_dpa(sbox, textins, traces, bitnum)
+    assert key_guess == loop_guess
+    np.testing.assert_allclose(peaks, loop_peaks, rtol=1e-10)
+    assert dpa_run(sbox, textins, traces, bitnum) == loop_guess
+
+
+def test_attack_pool_matches_engines(tmp_path, sbox, simulated):
+    from chipwhisperer_minimal.parallel_attacks import AttackPool, _share
+    from chipwhisperer_minimal.trace_store import TraceStore
+    textins, traces = simulated
+    store = TraceStore.create(str(tmp_path / "store"), traces.shape[1], np.float64)
+    store.append(textins, traces, list(range(16)))
+    # A slice of a memmap is mapped again by the workers, from its own position in the file
+    mapped = store.traces[10:]
+    assert _share(mapped)[0][0] == "memmap"
+
+    with AttackPool(2) as pool:
+        # Several windows per byte, some tasks reusing the window of the task before them
+        for trace_array, rows in [(traces, slice(None)), (mapped, slice(10, None))]:
+            key_guess, peaks = pool.cpa_engine(sbox, textins[rows], trace_array, window_size=16)
+            engine_guess, engine_peaks = cpa_engine(sbox, textins[rows], traces[rows])
+            assert key_guess == engine_guess
+            np.testing.assert_allclose(peaks, engine_peaks, rtol=1e-10)
+
+            key_guess, peaks = pool.dpa_engine(sbox, textins[rows], trace_array, bitnum=5, window_size=16)
+            engine_guess, engine_peaks = dpa_engine(sbox, textins[rows], traces[rows], bitnum=5)
+            assert key_guess == engine_guess
+            np.testing.assert_allclose(peaks, engine_peaks, rtol=1e-10)
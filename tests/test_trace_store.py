@@ -0,0 +1,67 @@
+import os
+import numpy as np
+import pytest
+from chipwhisperer_minimal.trace_store import TraceStore
+
+def rows(n, samples=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (n, 16), dtype=np.uint8), rng.normal(size=(n, samples)).astype(np.float32)
+
+def test_truncated_append_reopens_with_committed_rows(tmp_path):
+    directory = str(tmp_path / "store")
+    store = TraceStore.create(directory, 8, np.float32, sbox_name="AES")
+    textins, traces = rows(5)
+    store.append(textins, traces, list(range(16)))
+
+    # An append interrupted after writing part of its data, before the manifest was replaced
+    _, more_traces = rows(3, seed=1)
+    with open(os.path.join(directory, "traces.bin"), "ab") as f:
+        f.write(more_traces.tobytes()[:50])
+    with open(os.path.join(directory, "textins.bin"), "ab") as f:
+        f.write(b"\x01" * 20)
+
+    reopened = TraceStore(directory)
+    assert len(reopened) == 5
+    np.testing.assert_array_equal(reopened.traces, traces)
+    np.testing.assert_array_equal(reopened.textins, textins)
+
+    # The next append overwrites the partial data
+    textins2, traces2 = rows(2, seed=2)
+    reopened.append(textins2, traces2, list(range(16)))
+    again = TraceStore(directory)
+    np.testing.assert_array_equal(again.traces, np.concatenate([traces, traces2]))
+    np.testing.assert_array_equal(again.textins, np.concatenate([textins, textins2]))
+
+def test_open_or_create_rejects_other_captures(tmp_path):
+    directory = str(tmp_path / "store")
+    TraceStore.open_or_create(directory, 8, np.float32, device="CWNANO", aes_mode="ECB")
+    assert len(TraceStore.open_or_create(directory, 8, np.float32, device="CWNANO", aes_mode="ECB")) == 0
+    with pytest.raises(ValueError):
+        TraceStore.open_or_create(directory, 8, np.float32, device="CWLITEARM", aes_mode="ECB")
+    with pytest.raises(ValueError):
+        TraceStore.open_or_create(directory, 16, np.float32, device="CWNANO", aes_mode="ECB")
+
+def test_recorded_tvla_groups_are_replayed(tmp_path, sbox):
+    from chipwhisperer_minimal.metrics import tvla, tvla_metrics
+    from chipwhisperer_minimal.simulator import SimulatorBackend
+    from chipwhisperer_minimal.trace_store import RecordingBackend, TraceStoreBackend
+    root = str(tmp_path)
+    simulator = SimulatorBackend({"AES": sbox}, seed=0, samples=40, offset=4, spacing=2)
+    simulator.firmware_id = "AES-CWNANO"
+    recording = RecordingBackend(simulator, root)
+    recording.prepare("AES", aes_mode="CTR")
+    assert recording.firmware_id == "AES-CWNANO"
+    fixed, random = recording.capture_tvla(50)
+    more_fixed, more_random = recording.capture_tvla(50)
+    recording.close()
+
+    replay = TraceStoreBackend(root)
+    replay.prepare("AES", aes_mode="CTR")
+    replay_fixed, replay_random = replay.capture_tvla(len(fixed) + 10)
+    np.testing.assert_array_equal(replay_fixed, np.concatenate([fixed, more_fixed])[:len(fixed) + 10])
+    np.testing.assert_array_equal(replay_random, np.concatenate([random, more_random])[:len(fixed) + 10])
+    with pytest.raises(EOFError):
+        replay.capture(10)
+
+    metrics = dict(tvla_metrics, METRIC_HIGH=40)
+    assert 0 <= tvla("AES", metrics=metrics, aes_mode="CTR", backend=TraceStoreBackend(root)) <= 100